@@ -11,7 +11,7 @@ except ImportError:
     TabbedTranslationAdmin = admin.ModelAdmin
 
 
-from . import models
+from . import models, routers
 
 
 class NotificationSchedulerInline(admin.TabularInline):
@@ -22,6 +22,12 @@ class NotifcationCategoryAdmin(TabbedTranslationAdmin):
     list_display = ('name', 'opt_out')
 
 
+class NotificationOptOutAdmin(admin.ModelAdmin):
+    list_display = ('token', 'category', 'created_at')
+    list_filter = ('category', )
+    search_fields = ('token', )
+
+
 class NotificationAdminForm(forms.ModelForm):
     class Meta:
         model = models.Notification
@@ -101,9 +107,31 @@ class NotificationInstanceAdmin(admin.ModelAdmin):
     list_filter = ('notification', 'canceled')
     date_hierarchy = 'scheduled_at'
 
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request)
+        # Listings are read from the replica, changes are made in the
+        # primary
+        if routers.REPLICA_DATABASE and request.method == 'GET':
+            queryset = queryset.using(routers.REPLICA_DATABASE)
+        return queryset
+
+
+class NotificationStatAdmin(admin.ModelAdmin):
+    list_display = ('day', 'notification', 'category', 'provider',
+                    'scheduled', 'sent', 'failed', 'canceled')
+    list_filter = ('category', 'provider', 'notification')
+    date_hierarchy = 'day'
+    readonly_fields = list_display
+
+    def has_add_permission(self, request):
+        # Maintained by djpush, see `stats.rebuild_stats`
+        return False
+
 
 admin.site.register(models.NotificationCategory, NotifcationCategoryAdmin)
+admin.site.register(models.NotificationOptOut, NotificationOptOutAdmin)
 admin.site.register(models.Notification, NotificationAdmin)
 admin.site.register(models.NotificationInstance, NotificationInstanceAdmin)
+admin.site.register(models.NotificationStat, NotificationStatAdmin)
 admin.site.register(models.SchedulerInTimeRange)
 admin.site.register(models.SchedulerMinutesLater)
@@ -0,0 +1,85 @@
+"""Schedule notifications from async code, like ASGI views.
+
+Scheduling needs the ORM, locks and transactions, so it runs in a pool
+of `DJPUSH_ASYNC_WORKERS` threads of its own instead of the event loop
+default executor. Providers are never called from those threads:
+instances are always enqueued, with the `ThreadExecutor` when
+`DJPUSH_EXECUTOR` is `sync` since it would send them in place.
+
+"""
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import functools
+import threading
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from .executors import SyncExecutor, ThreadExecutor, get_executor
+from .models import chunked, schedule_notification
+
+
+ASYNC_WORKERS = getattr(settings, 'DJPUSH_ASYNC_WORKERS', 4)
+# Notifications scheduled per thread by `aschedule_notifications`
+ASYNC_BATCH_SIZE = 100
+
+_pool = None
+_executor = None
+_lock = threading.Lock()
+
+
+def get_pool():
+    global _pool
+    with _lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(ASYNC_WORKERS)
+        return _pool
+
+
+def get_async_executor():
+    """The executor of instances scheduled from async code"""
+    global _executor
+    executor = get_executor()
+    if not isinstance(executor, SyncExecutor):
+        return executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadExecutor()
+        return _executor
+
+
+def _schedule(notifications):
+    close_old_connections()
+    try:
+        executor = get_async_executor()
+        return [schedule_notification(executor=executor, **kwargs)
+                for kwargs in notifications]
+    finally:
+        close_old_connections()
+
+
+async def aschedule_notification(timezone, slug, tokens, context=None,
+                                 provider=None, languages=None, using=None):
+    """Async version of `models.schedule_notification`"""
+    kwargs = {'timezone': timezone, 'slug': slug, 'tokens': tokens,
+              'context': context, 'provider': provider,
+              'languages': languages, 'using': using}
+    loop = asyncio.get_event_loop()
+    result = await loop.run_in_executor(
+        get_pool(), functools.partial(_schedule, [kwargs]))
+    return result[0]
+
+
+async def aschedule_notifications(notifications):
+    """Schedule `notifications`, dicts of `schedule_notification`
+    arguments. They are scheduled in batches of `ASYNC_BATCH_SIZE`, each
+    batch in a thread. Return the instances(or `None`) in the same
+    order.
+
+    """
+    loop = asyncio.get_event_loop()
+    pool = get_pool()
+    batches = await asyncio.gather(*[
+        loop.run_in_executor(pool, functools.partial(_schedule, batch))
+        for batch in chunked(list(notifications), ASYNC_BATCH_SIZE)])
+    return [instance for batch in batches for instance in batch]
@@ -0,0 +1,272 @@
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import atexit
+import datetime
+import threading
+import time
+import weakref
+
+from django.conf import settings
+from django.db.models import (BooleanField, Case, DateTimeField, IntegerField,
+                              TextField, Value, When)
+
+from .models import (NOTIFICATION_EXPIRES, PRIORITY_HIGH,
+                     NotificationInstance, add_stats, cancel_instances,
+                     chunked, load_payloads)
+
+
+RECORDER_BATCH_SIZE = getattr(settings, 'DJPUSH_RECORDER_BATCH_SIZE', 100)
+RECORDER_FLUSH_INTERVAL = getattr(
+    settings, 'DJPUSH_RECORDER_FLUSH_INTERVAL', 1)
+# Each row uses 7 parameters in the `UPDATE`, keep it under the
+# SQLite limit of 999
+RECORDER_CHUNK_SIZE = 100
+# Maximum number of instances sent per second, `None` means no limit
+SEND_RATE = getattr(settings, 'DJPUSH_SEND_RATE', None)
+
+_recorders = weakref.WeakSet()
+
+
+@atexit.register
+def _flush_recorders():
+    for recorder in list(_recorders):
+        recorder.flush()
+
+
+class ResultRecorder:
+    """Buffer the outcome(`sent_at` and `result`) of sent instances and
+    save them in one `UPDATE` per chunk when `batch_size` instances
+    are buffered or `flush_interval` seconds have passed since the
+    first one. Pending results are flushed when the process exits.
+
+    An instance is recorded only once, duplicates in the buffer are
+    ignored and rows that already have a `result` are not updated.
+    Updated rows are counted in the stats.
+
+    """
+    def __init__(self, batch_size=None, flush_interval=None):
+        self.batch_size = batch_size or RECORDER_BATCH_SIZE
+        if flush_interval is None:
+            flush_interval = RECORDER_FLUSH_INTERVAL
+        self.flush_interval = flush_interval
+        self._buffer = OrderedDict()
+        self._first_at = None
+        self._lock = threading.Lock()
+        _recorders.add(self)
+
+    def __len__(self):
+        return len(self._buffer)
+
+    def record(self, instance):
+        with self._lock:
+            if instance.pk in self._buffer:
+                return False
+            self._buffer[instance.pk] = (instance.sent_at, instance.result,
+                                         instance.failed,
+                                         instance.get_stats_row())
+            if self._first_at is None:
+                self._first_at = time.monotonic()
+            due = (len(self._buffer) >= self.batch_size or
+                   time.monotonic() - self._first_at >= self.flush_interval)
+        if due:
+            self.flush()
+        return True
+
+    def flush(self):
+        """Save buffered results. Return the number of updated rows"""
+        with self._lock:
+            buffer, self._buffer = self._buffer, OrderedDict()
+            self._first_at = None
+        updated = 0
+        for chunk in chunked(list(buffer.items()), RECORDER_CHUNK_SIZE):
+            sent_at = Case(*[
+                When(pk=pk, then=Value(values[0], output_field=DateTimeField()))
+                for pk, values in chunk])
+            result = Case(*[
+                When(pk=pk, then=Value(values[1], output_field=TextField()))
+                for pk, values in chunk])
+            failed = Case(*[
+                When(pk=pk, then=Value(values[2], output_field=BooleanField()))
+                for pk, values in chunk])
+            pks = [pk for pk, values in chunk]
+            chunk_updated = NotificationInstance.objects.filter(
+                pk__in=pks,
+                result='',
+            ).update(sent_at=sent_at, result=result, failed=failed)
+            if chunk_updated < len(chunk):
+                # Some were recorded before, only count ours
+                rows = NotificationInstance.objects.filter(
+                    pk__in=pks).values_list('pk', 'sent_at')
+                ours = {pk for pk, sent_at in rows
+                        if sent_at == buffer[pk][0]}
+                chunk = [(pk, values) for pk, values in chunk if pk in ours]
+            add_stats(values[3] for pk, values in chunk)
+            updated += chunk_updated
+        return updated
+
+
+class RateLimiter:
+    """Token bucket allowing `rate` sends per second on average and
+    bursts of up to `burst`(default `rate`) sends.
+
+    """
+    def __init__(self, rate, burst=None, clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst or max(rate, 1)
+        self.clock = clock
+        self._tokens = self.burst
+        self._updated_at = clock()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = self.clock()
+        self._tokens = min(
+            self.burst, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    def available(self):
+        """Number of instances that can be sent now"""
+        with self._lock:
+            self._refill()
+            return int(self._tokens)
+
+    def consume(self, count):
+        with self._lock:
+            self._refill()
+            self._tokens -= count
+
+
+def get_rate_limiter(rate=None):
+    """A `RateLimiter` for `rate` or `DJPUSH_SEND_RATE`, `None` if no
+    limit
+
+    """
+    rate = rate or SEND_RATE
+    if not rate:
+        return None
+    return RateLimiter(rate)
+
+
+def cancel_expired(now=None):
+    """Cancel unsent instances older than `DJPUSH_NOTIFICATION_EXPIRES`
+    seconds. Return the number of canceled instances.
+
+    """
+    if NOTIFICATION_EXPIRES is None:
+        return 0
+    now = now or datetime.datetime.utcnow()
+    expired_at = now - datetime.timedelta(seconds=NOTIFICATION_EXPIRES)
+    return cancel_instances(NotificationInstance.objects.filter(
+        scheduled_at__lt=expired_at), 'expired')
+
+
+def get_due_instances(now=None, limit=None, coordinator=None):
+    # `scheduled_at` is saved in UTC
+    now = now or datetime.datetime.utcnow()
+    instances = NotificationInstance.objects.filter(
+        sent_at__isnull=True,
+        canceled=False,
+        scheduled_at__lte=now,
+    ).annotate(
+        # High priority first
+        lane=Case(When(priority=PRIORITY_HIGH, then=Value(0)),
+                  default=Value(1), output_field=IntegerField())
+    ).order_by('lane', 'scheduled_at')
+    if coordinator is not None:
+        instances = coordinator.filter(instances)
+    if limit is not None:
+        instances = instances[:limit]
+    return instances
+
+
+def coalesce(instances):
+    """Cancel pending instances for the same tokens and collapse key as
+    any of `instances`, across notifications, but the newest. Return
+    `instances` that were not canceled.
+
+    """
+    groups = {(instance.fingerprint, instance.collapse_key)
+              for instance in instances
+              if instance.fingerprint and instance.collapse_key}
+    if not groups:
+        return instances
+    pending_by_group = {}
+    # Each group uses two parameters
+    for chunk in chunked(list(groups), 250):
+        pending = NotificationInstance.objects.filter(
+            fingerprint__in={fingerprint for fingerprint, key in chunk},
+            collapse_key__in={key for fingerprint, key in chunk},
+            sent_at__isnull=True,
+            canceled=False,
+        ).values_list('pk', 'fingerprint', 'collapse_key')
+        for pk, fingerprint, key in pending:
+            if (fingerprint, key) in groups:
+                pending_by_group.setdefault((fingerprint, key), []).append(pk)
+    # The newest has the highest primary key
+    older = set()
+    for pks in pending_by_group.values():
+        older.update(sorted(pks)[:-1])
+    for chunk in chunked(sorted(older), 500):
+        cancel_instances(NotificationInstance.objects.filter(pk__in=chunk),
+                         'collapsed')
+    return [instance for instance in instances if instance.pk not in older]
+
+
+def send_instances(instances, workers=1, recorder=None):
+    """Send `instances`. With more than one worker the providers are
+    called from a thread pool, results are recorded from the calling
+    thread. Return the number of sent instances.
+
+    """
+    flush = recorder is None
+    if flush:
+        recorder = ResultRecorder()
+    sent = 0
+    try:
+        if workers > 1:
+            load_payloads(instances)
+            with ThreadPoolExecutor(workers) as pool:
+                results = pool.map(lambda i: i.deliver(), instances)
+                for instance, result in zip(instances, results):
+                    if result is not None:
+                        recorder.record(instance)
+                        sent += 1
+        else:
+            for instance in instances:
+                if instance.send(recorder=recorder) is not None:
+                    sent += 1
+    finally:
+        if flush:
+            recorder.flush()
+    return sent
+
+
+def dispatch_due(now=None, limit=None, workers=1, recorder=None,
+                 coordinator=None, rate_limiter=None):
+    """Send instances scheduled before `now`, expired ones are
+    canceled and only the newest instance per tokens and collapse key is
+    sent. With a `sharding.Coordinator` only instances of the
+    partitions leased to this worker are sent, they are claimed before
+    calling the provider, and deliveries of dead workers are resumed.
+    With a `RateLimiter` the instances over the rate are left for the
+    next call. `recorder` is flushed before returning, buffered
+    instances would be due again on the next call. Return the number of
+    sent instances.
+
+    """
+    cancel_expired(now)
+    if rate_limiter is not None:
+        available = rate_limiter.available()
+        limit = available if limit is None else min(limit, available)
+        if not limit:
+            return 0
+    instances = coalesce(list(get_due_instances(now, limit, coordinator)))
+    if coordinator is not None:
+        instances = coordinator.resume() + coordinator.claim(instances)
+    if rate_limiter is not None:
+        rate_limiter.consume(len(instances))
+    try:
+        return send_instances(instances, workers, recorder)
+    finally:
+        if recorder is not None:
+            recorder.flush()
@@ -0,0 +1,180 @@
+from concurrent.futures import ThreadPoolExecutor
+import datetime
+import heapq
+import itertools
+import threading
+import time
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import close_old_connections, transaction
+from django.utils.module_loading import import_string
+
+from .models import NotificationInstance
+
+
+# Executors send the instances created by `schedule_notification`
+# `countdown` seconds later. Instances older than `expires` seconds
+# are dropped without calling the provider.
+
+
+def deliver_instance(pk):
+    """Send the instance with primary key `pk`. Used by executors
+    running out of the request, the instance is read again because it
+    could have been canceled meanwhile.
+
+    """
+    close_old_connections()
+    try:
+        try:
+            instance = NotificationInstance.objects.get(pk=pk)
+        except NotificationInstance.DoesNotExist:
+            return None
+        if instance.is_expired():
+            instance.expire()
+            return None
+        return instance.send()
+    finally:
+        close_old_connections()
+
+
+class BaseExecutor:
+    def submit(self, instance, countdown=0, expires=None):
+        """Enqueue `instance` once the current transaction is committed,
+        otherwise workers could not find it.
+
+        """
+        transaction.on_commit(
+            lambda: self.enqueue(instance.pk, countdown, expires))
+
+    def enqueue(self, pk, countdown=0, expires=None):
+        raise NotImplementedError
+
+
+class SyncExecutor(BaseExecutor):
+    """Send instances that are due in the current thread. Instances
+    scheduled for later are sent by the dispatcher(see `dispatch`).
+
+    """
+    def submit(self, instance, countdown=0, expires=None):
+        if countdown > 0:
+            return None
+        if instance.is_expired():
+            instance.expire()
+            return None
+        return instance.send()
+
+
+class ThreadExecutor(BaseExecutor):
+    """Send instances from a pool of `workers` threads in this process.
+    A single timer thread waits for the `countdown` of every instance.
+    Pending instances are lost if the process exits, the dispatcher
+    sends them later.
+
+    """
+    def __init__(self, workers=None):
+        self.workers = workers or getattr(
+            settings, 'DJPUSH_EXECUTOR_WORKERS', 4)
+        self._pool = None
+        self._heap = []
+        self._counter = itertools.count()
+        self._condition = threading.Condition()
+        self._thread = None
+
+    def enqueue(self, pk, countdown=0, expires=None):
+        due_at = time.monotonic() + max(countdown, 0)
+        with self._condition:
+            if self._thread is None:
+                self._pool = ThreadPoolExecutor(self.workers)
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+            heapq.heappush(self._heap, (due_at, next(self._counter), pk))
+            self._condition.notify()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._heap or self._heap[0][0] > time.monotonic():
+                    timeout = None
+                    if self._heap:
+                        timeout = self._heap[0][0] - time.monotonic()
+                    self._condition.wait(timeout)
+                due_at, count, pk = heapq.heappop(self._heap)
+            self._pool.submit(deliver_instance, pk)
+
+    def __len__(self):
+        return len(self._heap)
+
+
+class CeleryExecutor(BaseExecutor):
+    """Send instances with the celery task
+    `djpush.tasks.send_notification_instance`
+
+    """
+    def __init__(self, task=None):
+        if task is None:
+            try:
+                from .tasks import send_notification_instance as task
+            except ImportError:
+                raise ImproperlyConfigured(
+                    'CeleryExecutor requires celery to be installed')
+        self.task = task
+
+    def enqueue(self, pk, countdown=0, expires=None):
+        countdown = max(countdown, 0)
+        # Celery counts `expires` from now, we count from the schedule
+        if expires is not None:
+            expires += countdown
+        self.task.apply_async(args=(pk, ), countdown=countdown,
+                              expires=expires)
+
+
+class RQExecutor(BaseExecutor):
+    """Send instances with RQ. By default jobs are enqueued in the
+    `django_rq` "default" queue, workers must run with `--with-scheduler`
+    to run delayed jobs.
+
+    """
+    def __init__(self, queue=None):
+        if queue is None:
+            try:
+                import django_rq
+            except ImportError:
+                raise ImproperlyConfigured(
+                    'RQExecutor requires django-rq to be installed')
+            queue = django_rq.get_queue('default')
+        self.queue = queue
+
+    def enqueue(self, pk, countdown=0, expires=None):
+        if countdown > 0:
+            self.queue.enqueue_in(datetime.timedelta(seconds=countdown),
+                                  deliver_instance, pk, ttl=expires)
+        else:
+            self.queue.enqueue(deliver_instance, pk, ttl=expires)
+
+
+EXECUTORS = {
+    'sync': SyncExecutor,
+    'thread': ThreadExecutor,
+    'celery': CeleryExecutor,
+    'rq': RQExecutor,
+}
+
+_executor = None
+
+
+def get_executor():
+    """Return the executor configured in `DJPUSH_EXECUTOR`, a name in
+    `EXECUTORS` or the dotted path of a class.
+
+    """
+    global _executor
+    if _executor is None:
+        name = getattr(settings, 'DJPUSH_EXECUTOR', 'sync')
+        try:
+            executor_class = EXECUTORS.get(name) or import_string(name)
+        except ImportError:
+            raise ImproperlyConfigured(
+                '"%s" is not a valid DJPUSH_EXECUTOR' % name)
+        _executor = executor_class()
+    return _executor
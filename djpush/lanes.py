@@ -0,0 +1,221 @@
+from collections import OrderedDict, deque
+import datetime
+import queue
+import threading
+import time
+
+from django.conf import settings
+
+from .models import (PRIORITY_HIGH, PRIORITY_NORMAL, NotificationInstance,
+                     load_payloads)
+
+
+# Relative share of the shared threads used by each lane
+LANE_WEIGHTS = getattr(settings, 'DJPUSH_LANE_WEIGHTS', OrderedDict((
+    (PRIORITY_HIGH, 4),
+    (PRIORITY_NORMAL, 1),
+)))
+# Threads only used by a lane
+LANE_RESERVED = getattr(settings, 'DJPUSH_LANE_RESERVED', {PRIORITY_HIGH: 1})
+# Latencies kept to compute percentiles
+LATENCY_SAMPLES = 1000
+# Result of deliveries that failed after sending some chunks
+RESUME = object()
+
+
+def percentile(samples, q):
+    if not samples:
+        return None
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(round(q * (len(samples) - 1))))]
+
+
+class Lane:
+    def __init__(self, name, weight, reserved=0):
+        self.name = name
+        self.weight = weight
+        self.reserved = reserved
+        self.queue = deque()
+        self.current_weight = 0
+        self.in_flight = 0
+        self.sent = 0
+        self.latencies = deque(maxlen=LATENCY_SAMPLES)
+
+    def stats(self):
+        return {
+            'depth': len(self.queue),
+            'in_flight': self.in_flight,
+            'sent': self.sent,
+            'latency_p50': percentile(self.latencies, 0.5),
+            'latency_p99': percentile(self.latencies, 0.99),
+        }
+
+
+class LaneDispatcher:
+    """Call providers from a pool of `workers` threads with a lane per
+    notification priority, so a high priority notification doesn't wait
+    behind a large normal priority campaign. Lanes with reserved threads
+    always have them available, the other threads pick instances from
+    the lanes by smooth weighted round robin.
+
+    Only `deliver` runs in the threads, `collect` records the results
+    from the calling thread. Instances are `pending` from `submit` to
+    `collect`, they still look unsent in the database.
+
+    """
+    def __init__(self, workers=4, weights=None, reserved=None):
+        weights = weights or LANE_WEIGHTS
+        reserved = LANE_RESERVED if reserved is None else reserved
+        self.lanes = OrderedDict(
+            (name, Lane(name, weight, reserved.get(name, 0)))
+            for name, weight in weights.items())
+        self.workers = max(workers, sum(reserved.values()) + 1)
+        self._condition = threading.Condition()
+        self._done = queue.Queue()
+        self._pending = set()
+        self._threads = []
+        self._closed = False
+
+    def lane_for(self, instance):
+        # Unknown priorities go to the last lane
+        return self.lanes.get(instance.priority) or list(
+            self.lanes.values())[-1]
+
+    def submit(self, instances):
+        # Read from the calling thread, the lanes don't touch the database
+        load_payloads(instances)
+        with self._condition:
+            if not self._threads:
+                self._start()
+            now = time.monotonic()
+            for instance in instances:
+                if instance.pk in self._pending:
+                    continue
+                self._pending.add(instance.pk)
+                self.lane_for(instance).queue.append((instance, now))
+            self._condition.notify_all()
+
+    def _start(self):
+        shared = self.workers
+        for lane in self.lanes.values():
+            for i in range(lane.reserved):
+                self._start_thread([lane])
+            shared -= lane.reserved
+        for i in range(shared):
+            self._start_thread(list(self.lanes.values()))
+
+    def _start_thread(self, lanes):
+        thread = threading.Thread(target=self._run, args=(lanes, ),
+                                  daemon=True)
+        thread.start()
+        self._threads.append(thread)
+
+    def _next(self, lanes):
+        """Smooth weighted round robin between non empty `lanes`"""
+        lanes = [lane for lane in lanes if lane.queue]
+        if not lanes:
+            return None
+        total = 0
+        chosen = None
+        for lane in lanes:
+            lane.current_weight += lane.weight
+            total += lane.weight
+            if chosen is None or lane.current_weight > chosen.current_weight:
+                chosen = lane
+        chosen.current_weight -= total
+        return chosen
+
+    def _run(self, lanes):
+        while True:
+            with self._condition:
+                lane = self._next(lanes)
+                while lane is None:
+                    if self._closed:
+                        return
+                    self._condition.wait()
+                    lane = self._next(lanes)
+                instance, enqueued_at = lane.queue.popleft()
+                lane.in_flight += 1
+            sent_tokens = instance.sent_tokens
+            try:
+                result = instance.deliver()
+            except Exception as e:
+                if instance.sent_tokens > sent_tokens:
+                    # Chunks were sent, the next attempt resumes after
+                    # them
+                    result = RESUME
+                else:
+                    # Nobody to raise it to. Record it as the result,
+                    # the instance is not sent again.
+                    instance.sent_at = datetime.datetime.now()
+                    instance.result = repr(e)
+                    instance.failed = True
+                    result = e
+            with self._condition:
+                lane.in_flight -= 1
+                # Expired, canceled or sent elsewhere, or resumed later
+                if result is not None and result is not RESUME:
+                    lane.sent += 1
+                lane.latencies.append(time.monotonic() - enqueued_at)
+                self._condition.notify_all()
+            self._done.put((instance, result))
+
+    def collect(self, recorder):
+        """Record delivered instances, the ones to resume are due again.
+        Return the number of recorded instances.
+
+        """
+        recorded = 0
+        while True:
+            try:
+                instance, result = self._done.get_nowait()
+            except queue.Empty:
+                return recorded
+            with self._condition:
+                self._pending.discard(instance.pk)
+            if result is RESUME:
+                # Released if it was claimed and not resumed by another
+                # worker meanwhile, see `sharding`
+                NotificationInstance.objects.filter(
+                    pk=instance.pk, claimed_by=instance.claimed_by,
+                    result=''
+                ).update(sent_at=None, claimed_by='', claimed_at=None)
+            elif result is not None:
+                recorder.record(instance)
+                recorded += 1
+
+    def pending(self):
+        """Primary keys of the instances submitted and not collected"""
+        with self._condition:
+            return set(self._pending)
+
+    def __len__(self):
+        """Instances not delivered yet"""
+        with self._condition:
+            return sum(len(lane.queue) + lane.in_flight
+                       for lane in self.lanes.values())
+
+    def wait(self, timeout=None):
+        """Wait until all the submitted instances are delivered"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            while any(lane.queue or lane.in_flight
+                      for lane in self.lanes.values()):
+                remaining = None
+                if deadline is not None:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return False
+                self._condition.wait(remaining)
+        return True
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        for thread in self._threads:
+            thread.join()
+
+    def stats(self):
+        with self._condition:
+            return {name: lane.stats() for name, lane in self.lanes.items()}
@@ -0,0 +1,237 @@
+"""Measure djpush throughput against a local fake provider.
+
+`FakeProviderServer` imitates OneSignal, GCM and APNs style endpoints
+with configurable latency, errors, throttling and invalid tokens.
+`run_load_test` schedules and dispatches notifications through
+`schedule_notification` and `dispatch.dispatch_due` using the
+`LOADTEST` provider, that sends them to the fake server.
+
+"""
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+import datetime
+import json
+import random
+import threading
+import time
+import zlib
+
+import requests
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+import pytz
+
+from . import dispatch, models, providers
+from .lanes import percentile
+
+
+LOADTEST = 'loadtest'
+ONESIGNAL = 'onesignal'
+GCM = 'gcm'
+APNS = 'apns'
+
+
+class FakeProviderHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        server = self.server
+        length = int(self.headers.get('Content-Length', 0))
+        body = json.loads(self.rfile.read(length).decode() or '{}')
+        if server.latency:
+            time.sleep(server.latency)
+        roll = server.roll()
+        if roll < server.throttle_rate:
+            return self.respond(429, {'errors': ['Rate limit exceeded']},
+                                {'Retry-After': '1'})
+        if roll < server.throttle_rate + server.error_rate:
+            return self.respond(500, {'errors': ['Internal server error']})
+
+        if self.path == '/api/v1/notifications':
+            tokens = body.get('include_player_ids', [])
+            invalid = [token for token in tokens if server.is_invalid(token)]
+            response = {'id': 'loadtest', 'recipients': len(tokens) - len(invalid)}
+            if invalid:
+                response['errors'] = {'invalid_player_ids': invalid}
+            return self.respond(200, response)
+        if self.path == '/fcm/send':
+            tokens = body.get('registration_ids', [])
+            results = [{'error': 'InvalidRegistration'}
+                       if server.is_invalid(token) else {'message_id': '1'}
+                       for token in tokens]
+            failure = sum('error' in result for result in results)
+            return self.respond(200, {'success': len(tokens) - failure,
+                                      'failure': failure,
+                                      'results': results})
+        if self.path.startswith('/3/device/'):
+            token = self.path.rsplit('/', 1)[-1]
+            if server.is_invalid(token):
+                return self.respond(400, {'reason': 'BadDeviceToken'})
+            return self.respond(200, {})
+        return self.respond(404, {'errors': ['Not found']})
+
+    def respond(self, status, body, headers=None):
+        content = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(content)
+        self.server.count(status)
+
+
+class FakeProviderServer(ThreadingMixIn, HTTPServer):
+    """Fake provider listening in a local port. `latency` seconds are
+    waited before answering, a `throttle_rate` fraction of requests get
+    a 429 and an `error_rate` fraction a 500. A deterministic
+    `invalid_rate` fraction of tokens are reported as invalid.
+
+    """
+    daemon_threads = True
+
+    def __init__(self, latency=0, error_rate=0, throttle_rate=0,
+                 invalid_rate=0, seed=0, port=0):
+        super().__init__(('127.0.0.1', port), FakeProviderHandler)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.invalid_rate = invalid_rate
+        self.responses = Counter()
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def url(self):
+        return 'http://{}:{}'.format(*self.server_address)
+
+    def roll(self):
+        with self._lock:
+            return self._random.random()
+
+    def is_invalid(self, token):
+        return zlib.crc32(token.encode()) % 10000 < self.invalid_rate * 10000
+
+    def count(self, status):
+        with self._lock:
+            self.responses[status] += 1
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+
+class FakeProvider:
+    """Provider sending to `url` in `style`. Provider call latencies are
+    kept in `latencies`.
+
+    """
+    url = None
+    style = ONESIGNAL
+    latencies = []
+    _lock = threading.Lock()
+    _session = threading.local()
+
+    @classmethod
+    def session(cls):
+        # A session per thread keeps connections open
+        if not hasattr(cls._session, 'value'):
+            cls._session.value = requests.Session()
+        return cls._session.value
+
+    def send(self, to, data):
+        start = time.monotonic()
+        if self.style == APNS:
+            response = None
+            for token in to:
+                response = self.post('/3/device/' + token, data)
+                if response.status_code != requests.codes.ok:
+                    break
+        elif self.style == GCM:
+            response = self.post('/fcm/send', dict(data, registration_ids=to))
+        else:
+            response = self.post('/api/v1/notifications',
+                                 dict(data, include_player_ids=to))
+        with self._lock:
+            self.latencies.append(time.monotonic() - start)
+        return response
+
+    def post(self, path, data):
+        return self.session().post(self.url + path, json=data, timeout=30)
+
+
+def register_provider(url, style=ONESIGNAL):
+    FakeProvider.url = url
+    FakeProvider.style = style
+    FakeProvider.latencies = []
+    providers.register(LOADTEST, FakeProvider)
+
+
+def run_load_test(url, instances=1000, tokens=1, workers=4,
+                  style=ONESIGNAL):
+    """Schedule `instances` notifications of `tokens` tokens each and
+    dispatch them to the fake provider at `url`. Return a report with
+    throughput, provider latency percentiles and database queries.
+
+    Data is written to the default database, run it in a transaction
+    rolled back afterwards.
+
+    """
+    register_provider(url, style)
+    notification, created = models.Notification.objects.update_or_create(
+        slug='djpush-loadtest',
+        defaults={'name': 'Load test', 'enabled': True,
+                  'title': 'Load test {{ i }}', 'body': 'Hello {{ i }}'})
+    # Scheduled for later so they are sent by the dispatcher
+    scheduler = models.SchedulerMinutesLater.objects.create(minutes=1)
+    models.NotificationScheduler.objects.get_or_create(
+        notification=notification, scheduler=scheduler, order=0)
+
+    with CaptureQueriesContext(connection) as schedule_queries:
+        start = time.monotonic()
+        for i in range(instances):
+            models.schedule_notification(
+                pytz.utc, notification.slug,
+                ['loadtest-{}-{}'.format(i, j) for j in range(tokens)],
+                context={'i': i % 10}, provider=LOADTEST)
+        schedule_seconds = time.monotonic() - start
+
+    now = datetime.datetime.utcnow() + datetime.timedelta(minutes=2)
+    with CaptureQueriesContext(connection) as dispatch_queries:
+        start = time.monotonic()
+        sent = dispatch.dispatch_due(now=now, workers=workers)
+        dispatch_seconds = time.monotonic() - start
+
+    latencies = FakeProvider.latencies
+    return {
+        'instances': instances,
+        'tokens': instances * tokens,
+        'sent': sent,
+        'schedule_seconds': schedule_seconds,
+        'schedule_per_second': instances / schedule_seconds,
+        'schedule_queries': len(schedule_queries),
+        'dispatch_seconds': dispatch_seconds,
+        'sends_per_second': sent / dispatch_seconds,
+        'dispatch_queries': len(dispatch_queries),
+        'latency_p50': percentile(latencies, 0.5),
+        'latency_p95': percentile(latencies, 0.95),
+        'latency_p99': percentile(latencies, 0.99),
+    }
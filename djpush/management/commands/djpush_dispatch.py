@@ -0,0 +1,53 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from djpush.dispatch import ResultRecorder, dispatch_due, get_rate_limiter
+from djpush.models import prune_locks
+from djpush.sharding import Coordinator
+
+
+class Command(BaseCommand):
+    help = "Send notification instances that are due"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=1,
+            help="Number of threads calling the provider")
+        parser.add_argument(
+            '--limit', type=int, default=None,
+            help="Maximum number of instances sent per iteration")
+        parser.add_argument(
+            '--interval', type=float, default=0,
+            help="Seconds between iterations. Run once if 0")
+        parser.add_argument(
+            '--rate', type=float, default=None,
+            help="Maximum number of instances sent per second, "
+                 "DJPUSH_SEND_RATE by default")
+        parser.add_argument(
+            '--shard', action='store_true',
+            help="Only send the partitions leased to this process")
+
+    def handle(self, *args, **options):
+        recorder = ResultRecorder()
+        coordinator = Coordinator() if options['shard'] else None
+        rate_limiter = get_rate_limiter(options['rate'])
+        try:
+            while True:
+                if coordinator is not None:
+                    coordinator.heartbeat()
+                prune_locks()
+                sent = dispatch_due(limit=options['limit'],
+                                    workers=options['workers'],
+                                    recorder=recorder,
+                                    coordinator=coordinator,
+                                    rate_limiter=rate_limiter)
+                if options['verbosity'] > 1:
+                    self.stdout.write('Sent {} notification(s)'.format(sent))
+                if not options['interval']:
+                    break
+                time.sleep(options['interval'])
+        finally:
+            recorder.flush()
+            if coordinator is not None:
+                coordinator.unregister()
@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from djpush.loadtest import (APNS, GCM, ONESIGNAL, FakeProviderServer,
+                             run_load_test)
+
+
+class Command(BaseCommand):
+    help = ("Schedule and send notifications to a local fake provider and "
+            "report throughput. Nothing is saved in the database.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--instances', type=int, default=1000)
+        parser.add_argument('--tokens', type=int, default=1,
+                            help="Tokens per instance")
+        parser.add_argument('--workers', type=int, default=4)
+        parser.add_argument('--style', choices=(ONESIGNAL, GCM, APNS),
+                            default=ONESIGNAL)
+        parser.add_argument('--latency', type=float, default=0.05,
+                            help="Seconds the provider takes to answer")
+        parser.add_argument('--error-rate', type=float, default=0)
+        parser.add_argument('--throttle-rate', type=float, default=0)
+        parser.add_argument('--invalid-rate', type=float, default=0)
+
+    def handle(self, *args, **options):
+        server = FakeProviderServer(latency=options['latency'],
+                                    error_rate=options['error_rate'],
+                                    throttle_rate=options['throttle_rate'],
+                                    invalid_rate=options['invalid_rate'])
+        with server, transaction.atomic():
+            report = run_load_test(server.url,
+                                   instances=options['instances'],
+                                   tokens=options['tokens'],
+                                   workers=options['workers'],
+                                   style=options['style'])
+            transaction.set_rollback(True)
+        report['responses'] = dict(server.responses)
+        for key, value in report.items():
+            if isinstance(value, float):
+                value = '{:.4f}'.format(value)
+            self.stdout.write('{}: {}'.format(key, value))
@@ -0,0 +1,23 @@
+import datetime
+
+from django.core.management.base import BaseCommand
+
+from djpush.stats import rebuild_stats
+
+
+def date(value):
+    return datetime.datetime.strptime(value, '%Y-%m-%d').date()
+
+
+class Command(BaseCommand):
+    help = "Compute the delivery statistics again from the instances"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--since', type=date, default=None,
+            help="First day(YYYY-MM-DD) to rebuild. All of them by default")
+
+    def handle(self, *args, **options):
+        rows = rebuild_stats(options['since'])
+        if options['verbosity'] > 0:
+            self.stdout.write('Rebuilt {} row(s)'.format(rows))
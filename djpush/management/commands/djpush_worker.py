@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand
+
+from djpush.dispatch import get_rate_limiter
+from djpush.lanes import LaneDispatcher
+from djpush.sharding import Coordinator
+from djpush.worker import Worker
+
+
+class Command(BaseCommand):
+    help = "Send notification instances when they are due"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=1,
+            help="Number of threads calling the provider, including "
+                 "the ones reserved by DJPUSH_LANE_RESERVED")
+        parser.add_argument(
+            '--horizon', type=float, default=None,
+            help="Load instances due in the next seconds")
+        parser.add_argument(
+            '--poll-interval', type=float, default=None,
+            help="Seconds between database polls")
+        parser.add_argument(
+            '--rate', type=float, default=None,
+            help="Maximum number of instances sent per second, "
+                 "DJPUSH_SEND_RATE by default")
+        parser.add_argument(
+            '--shard', action='store_true',
+            help="Only send the partitions leased to this process")
+
+    def handle(self, *args, **options):
+        worker = Worker(horizon=options['horizon'],
+                        poll_interval=options['poll_interval'],
+                        lanes=LaneDispatcher(options['workers']),
+                        coordinator=Coordinator() if options['shard'] else None,
+                        rate_limiter=get_rate_limiter(options['rate']))
+        try:
+            worker.run()
+        except KeyboardInterrupt:
+            pass
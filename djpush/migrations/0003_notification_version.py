@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 21:08
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('djpush', '0002_notificationoptout'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notification',
+            name='version',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+    ]
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 21:11
+from __future__ import unicode_literals
+
+import hashlib
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def set_fingerprints(apps, schema_editor):
+    NotificationInstance = apps.get_model('djpush', 'NotificationInstance')
+    # Only pending instances are looked up by fingerprint
+    instances = NotificationInstance.objects.filter(
+        sent_at__isnull=True, canceled=False).only('tokens')
+    for instance in instances.iterator():
+        fingerprint = hashlib.sha1(instance.tokens.encode()).hexdigest()
+        NotificationInstance.objects.filter(pk=instance.pk).update(
+            fingerprint=fingerprint)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('djpush', '0003_notification_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NotificationLock',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fingerprint', models.CharField(max_length=40)),
+                ('locked_at', models.DateTimeField()),
+                ('notification', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='djpush.Notification')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='notificationinstance',
+            name='fingerprint',
+            field=models.CharField(blank=True, default='', max_length=40),
+        ),
+        migrations.AlterIndexTogether(
+            name='notificationinstance',
+            index_together=set([('notification', 'fingerprint', 'scheduled_at')]),
+        ),
+        migrations.AlterUniqueTogether(
+            name='notificationlock',
+            unique_together=set([('notification', 'fingerprint')]),
+        ),
+        migrations.RunPython(set_fingerprints, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 21:15
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('djpush', '0004_notificationlock'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='notificationinstance',
+            name='scheduled_at',
+            field=models.DateTimeField(db_index=True, null=True),
+        ),
+    ]
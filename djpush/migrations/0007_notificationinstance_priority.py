@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 21:18
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def set_priorities(apps, schema_editor):
+    Notification = apps.get_model('djpush', 'Notification')
+    NotificationInstance = apps.get_model('djpush', 'NotificationInstance')
+    for notification in Notification.objects.only('priority').iterator():
+        NotificationInstance.objects.filter(
+            notification=notification).update(priority=notification.priority)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('djpush', '0006_sharding'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notificationinstance',
+            name='priority',
+            field=models.CharField(choices=[('normal', 'Normal'), ('high', 'High')], default='high', max_length=20),
+        ),
+        migrations.RunPython(set_priorities, migrations.RunPython.noop),
+    ]
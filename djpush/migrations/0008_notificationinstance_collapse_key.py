@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 21:20
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def set_collapse_keys(apps, schema_editor):
+    Notification = apps.get_model('djpush', 'Notification')
+    NotificationInstance = apps.get_model('djpush', 'NotificationInstance')
+    notifications = Notification.objects.exclude(
+        gcm_option_collapse_key='').only('gcm_option_collapse_key')
+    for notification in notifications.iterator():
+        NotificationInstance.objects.filter(
+            notification=notification, sent_at__isnull=True
+        ).update(collapse_key=notification.gcm_option_collapse_key)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('djpush', '0007_notificationinstance_priority'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notificationinstance',
+            name='collapse_key',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.AlterIndexTogether(
+            name='notificationinstance',
+            index_together=set([('fingerprint', 'collapse_key'), ('notification', 'fingerprint', 'scheduled_at')]),
+        ),
+        migrations.RunPython(set_collapse_keys, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 21:28
+from __future__ import unicode_literals
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('djpush', '0009_payload'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='schedulerintimerange',
+            name='ramp_minutes',
+            field=models.IntegerField(default=0, help_text='Notifications scheduled for the start hour are spread over these minutes. The same tokens always get the same delay', validators=[django.core.validators.MinValueValidator(0)]),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 21:33
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('djpush', '0010_schedulerintimerange_ramp_minutes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notificationinstance',
+            name='sent_tokens',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
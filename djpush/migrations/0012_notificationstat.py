@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 21:36
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('djpush', '0011_notificationinstance_sent_tokens'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NotificationStat',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('provider', models.CharField(max_length=20)),
+                ('day', models.DateField()),
+                ('scheduled', models.PositiveIntegerField(default=0)),
+                ('canceled', models.PositiveIntegerField(default=0)),
+                ('sent', models.PositiveIntegerField(default=0)),
+                ('failed', models.PositiveIntegerField(default=0)),
+                ('category', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='djpush.NotificationCategory')),
+                ('notification', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='djpush.Notification')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='notificationinstance',
+            name='failed',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AlterUniqueTogether(
+            name='notificationstat',
+            unique_together=set([('notification', 'provider', 'day')]),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 22:21
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('djpush', '0012_notificationstat'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='notificationlock',
+            name='locked_at',
+            field=models.DateTimeField(db_index=True),
+        ),
+    ]
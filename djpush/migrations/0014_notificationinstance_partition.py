@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 22:23
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import F
+import djpush.models
+
+
+def set_partitions(apps, schema_editor):
+    NotificationInstance = apps.get_model('djpush', 'NotificationInstance')
+    # The partitions they had, only unfinished instances are sharded
+    partitions = getattr(settings, 'DJPUSH_PARTITIONS', 64)
+    NotificationInstance.objects.filter(result='', canceled=False).update(
+        partition=F('id') % partitions)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('djpush', '0013_notificationlock_locked_at_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notificationinstance',
+            name='partition',
+            field=models.PositiveSmallIntegerField(default=djpush.models.random_partition),
+        ),
+        migrations.RunPython(set_partitions, migrations.RunPython.noop),
+        migrations.AlterIndexTogether(
+            name='notificationinstance',
+            index_together=set([('notification', 'fingerprint', 'scheduled_at'), ('fingerprint', 'collapse_key'), ('partition', 'scheduled_at')]),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 22:25
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('djpush', '0014_notificationinstance_partition'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notificationinstance',
+            name='claimed_at',
+            field=models.DateTimeField(null=True),
+        ),
+    ]
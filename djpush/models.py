@@ -1,18 +1,20 @@
-from collections import defaultdict
+from collections import Counter, defaultdict
+import copy
 import datetime
+import hashlib
 import json
+import random
 
-import pypn
-import requests
 from django.conf import settings
-from django.core.exceptions import (ImproperlyConfigured,
-                                    ObjectDoesNotExist, ValidationError)
+from django.core.exceptions import ObjectDoesNotExist, ValidationError
 from django.core.validators import MaxValueValidator, MinValueValidator
-from django.db import models
+from django.db import (DEFAULT_DB_ALIAS, IntegrityError, connection, models,
+                       router, transaction)
 from django.template import Context, Template
 from timezone_field import TimeZoneField
 
-from . import schedulers
+from . import providers, schedulers
+from .caches import LRUCache
 
 
 PRIORITY_NORMAL = 'normal'
@@ -22,18 +24,16 @@ PRIORITY_CHOICES = (
     (PRIORITY_HIGH, "High"),
 )
 SEND_NOTIFICATION_KWARGS = {}
-
-DEFAULT_PROVIDER = getattr(settings, 'DJPUSH_DEFAULT_PROVIDER')
-if DEFAULT_PROVIDER is None:
-    raise ImproperlyConfigured(
-        'A default notification provider is required. '
-        'Check README for details.')
+# The same as `pypn.four_weeks_in_seconds`, pypn is only imported to send
+FOUR_WEEKS_IN_SECONDS = 40320
+HTTP_OK = 200
 
 try:
     _expires = int(getattr(settings, 'DJPUSH_NOTIFICATION_EXPIRES'))
     SEND_NOTIFICATION_KWARGS.update({'expires': _expires})
 except (AttributeError, TypeError, ValueError):
     pass
+NOTIFICATION_EXPIRES = SEND_NOTIFICATION_KWARGS.get('expires')
 
 
 try:
@@ -47,6 +47,11 @@ try:
 except AttributeError:
     LANGUAGES = []
 
+# Rendered payloads, see `Notification.as_dict`
+render_cache = LRUCache(getattr(settings, 'DJPUSH_RENDER_CACHE_SIZE', 1024))
+# Stored payloads by digest, see `get_payloads`
+payload_cache = LRUCache(getattr(settings, 'DJPUSH_PAYLOAD_CACHE_SIZE', 1024))
+
 
 class NotificationCategory(models.Model):
     name = models.CharField(max_length=100)
@@ -57,6 +62,78 @@ class NotificationCategory(models.Model):
         return self.name
 
 
+# Maximum number of tokens used in a single `IN` clause. SQLite
+# doesn't accept more than 999 parameters per query.
+TOKENS_CHUNK_SIZE = 500
+# Maximum number of tokens sent to the provider at once, GCM doesn't
+# accept more than 1000
+DELIVERY_CHUNK_SIZE = getattr(settings, 'DJPUSH_DELIVERY_CHUNK_SIZE', 1000)
+# Seconds a `NotificationLock` row is kept after its last use
+LOCK_RETENTION = getattr(settings, 'DJPUSH_LOCK_RETENTION', 3600)
+# Instances are split in this number of partitions, see `sharding`
+PARTITIONS = getattr(settings, 'DJPUSH_PARTITIONS', 64)
+
+
+def chunked(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def random_partition():
+    """The partition of a new instance"""
+    return random.randrange(PARTITIONS)
+
+
+class NotificationOptOut(models.Model):
+    """A device token that doesn't want to receive notifications of a
+    category. Only honored for categories with `opt_out` checked.
+
+    """
+    category = models.ForeignKey(NotificationCategory)
+    token = models.CharField(max_length=255)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        # Also the index used to filter tokens when scheduling
+        unique_together = ('category', 'token')
+
+    def __str__(self):
+        return '{} opted-out {}'.format(self.token, self.category)
+
+
+def opt_out(category, tokens):
+    """Opt-out `tokens` from `category`. Tokens already opted-out are
+    ignored.
+
+    """
+    tokens = set(tokens)
+    opted_out = get_opted_out(category, tokens)
+    NotificationOptOut.objects.bulk_create(
+        [NotificationOptOut(category=category, token=token)
+         for token in tokens - opted_out])
+
+
+def opt_in(category, tokens):
+    """Undo `opt_out`"""
+    for chunk in chunked(list(set(tokens)), TOKENS_CHUNK_SIZE):
+        NotificationOptOut.objects.filter(
+            category=category, token__in=chunk).delete()
+
+
+def get_opted_out(category, tokens):
+    """Return the set of `tokens` opted-out from `category`. Tokens are
+    matched in SQL using the `(category, token)` index, one query per
+    `TOKENS_CHUNK_SIZE` tokens.
+
+    """
+    opted_out = set()
+    for chunk in chunked(list(tokens), TOKENS_CHUNK_SIZE):
+        opted_out.update(NotificationOptOut.objects.filter(
+            category=category, token__in=chunk
+        ).values_list('token', flat=True))
+    return opted_out
+
+
 def ValidNotificationSlug(value):
     if value not in [i[0] for i in NOTIFICATION_CHOICES]:
         raise ValidationError('%s not in "DJPUSH_NOTIFICATION_CHOISES"'
@@ -132,7 +209,7 @@ class Notification(models.Model):
     gcm_option_time_to_live = models.IntegerField(
         null=True,
         blank=True,
-        validators=[MaxValueValidator(pypn.four_weeks_in_seconds)],
+        validators=[MaxValueValidator(FOUR_WEEKS_IN_SECONDS)],
         help_text="This parameter specifies how long (in seconds) the message "
                   "should be kept in GCM storage if the device is offline. "
                   "The maximum time to live supported is 4 weeks"
@@ -150,8 +227,56 @@ class Notification(models.Model):
     # OneSignal custom fields
     os_template_id = models.TextField(default='', blank=True)
 
-    def as_dict(self, context=None):
+    # Incremented on every save, used to invalidate rendered payloads
+    version = models.PositiveIntegerField(default=0, editable=False)
+
+    def save(self, *args, **kwargs):
+        using = kwargs.get('using') or router.db_for_write(
+            Notification, instance=self)
+        with transaction.atomic(using=using):
+            # Incremented in the database, the row stays locked until
+            # the end of the transaction so concurrent saves of stale
+            # copies get different versions
+            rows = Notification.objects.using(using).filter(pk=self.pk)
+            if self.pk is not None and rows.update(
+                    version=models.F('version') + 1):
+                self.version = rows.values_list('version', flat=True).get()
+            else:
+                self.version += 1
+            update_fields = kwargs.get('update_fields')
+            if update_fields is not None:
+                kwargs['update_fields'] = set(update_fields) | {'version'}
+            super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        # A new notification could get the same `pk` and `version`
+        render_cache.clear()
+        return super().delete(*args, **kwargs)
+
+    def as_dict(self, context=None, languages=None):
+        """Return the data to pass to pypn. `title` and `body` are
+        rendered with `context` for every language in `LANGUAGES`, or
+        only for `languages` if given. Results of saved notifications
+        are kept in `render_cache` when `context` is json serializable.
+
+        """
         context = context or {}
+        if self.pk is None:
+            return self._as_dict(context, languages)
+        if languages is not None:
+            languages = frozenset(languages)
+        context_hash = get_context_hash(context)
+        if context_hash is None:
+            return self._as_dict(context, languages)
+        key = (self.pk, self.version, languages, context_hash)
+        result = render_cache.get(key)
+        if result is None:
+            result = self._as_dict(context, languages)
+            render_cache.set(key, result)
+        # Callers are free to modify the result
+        return copy.deepcopy(result)
+
+    def _as_dict(self, context, languages):
         # Fields we want to render
         dynamic_keys = ['body', 'title']
         # To get translations
@@ -159,7 +284,8 @@ class Notification(models.Model):
         # Exclude administrative fields
         excluded_keys = ['id', 'name', 'slug', 'description', 'enabled',
                          'notificationscheduler', 'notificationinstance',
-                         'category']
+                         'notificationlock', 'notificationstat', 'category',
+                         'version']
         # Exclude translation fields
         for field in fields:
             if field.name.split('_')[-1] in LANGUAGES:
@@ -182,6 +308,8 @@ class Notification(models.Model):
                 pass
             # If translation *is* enabled
             for language in LANGUAGES:
+                if languages is not None and language not in languages:
+                    continue
                 try:
                     template = Template(getattr(self, field + '_' + language))
                 except AttributeError:
@@ -200,6 +328,19 @@ class Notification(models.Model):
         return self.name
 
 
+def get_context_hash(context):
+    """Hash of `context` independent of key order, `None` if it isn't
+    json serializable. Objects can't be hashed by their `str`, different
+    ones could render differently.
+
+    """
+    try:
+        canonical = json.dumps(context, sort_keys=True)
+    except (TypeError, ValueError):
+        return None
+    return hashlib.sha1(canonical.encode()).hexdigest()
+
+
 class NotificationScheduler(models.Model):
     """A notification could have more than one scheduler. Schedulers are
     applied in order. Order of schedulers is important in some
@@ -224,6 +365,84 @@ class NotificationScheduler(models.Model):
         unique_together = ('notification', 'scheduler', 'order')
 
 
+class Payload(models.Model):
+    """Data sent to the provider, stored once and shared by all the
+    instances sending it. `digest` is the hash of `data`, the
+    canonical json of the payload.
+
+    """
+    digest = models.CharField(max_length=64, primary_key=True)
+    data = models.TextField()
+
+    def __str__(self):
+        return self.digest
+
+
+def get_payload_digest(data):
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+def save_payloads(datas):
+    """Store the canonical json `datas`, one row per distinct payload.
+    Return their digests in the same order. Payloads are looked up and
+    created in bulk, one query per `TOKENS_CHUNK_SIZE` payloads.
+
+    """
+    digests = [get_payload_digest(data) for data in datas]
+    unique = dict(zip(digests, datas))
+    existing = set()
+    for chunk in chunked(list(unique), TOKENS_CHUNK_SIZE):
+        existing.update(Payload.objects.filter(
+            digest__in=chunk).values_list('digest', flat=True))
+    missing = [Payload(digest=digest, data=data)
+               for digest, data in unique.items() if digest not in existing]
+    try:
+        if missing:
+            with transaction.atomic():
+                Payload.objects.bulk_create(missing)
+    except IntegrityError:
+        # Some were created by a concurrent call
+        for payload in missing:
+            try:
+                with transaction.atomic():
+                    payload.save(force_insert=True)
+            except IntegrityError:
+                pass
+    for digest, data in unique.items():
+        payload_cache.set(digest, data)
+    return digests
+
+
+def get_payloads(digests):
+    """Return a dict of digest to data, read through `payload_cache`.
+    Payloads are immutable so cached ones never get stale.
+
+    """
+    result = {}
+    missing = []
+    for digest in set(digests):
+        data = payload_cache.get(digest)
+        if data is None:
+            missing.append(digest)
+        else:
+            result[digest] = data
+    for chunk in chunked(missing, TOKENS_CHUNK_SIZE):
+        for digest, data in Payload.objects.filter(
+                digest__in=chunk).values_list('digest', 'data'):
+            payload_cache.set(digest, data)
+            result[digest] = data
+    return result
+
+
+def load_payloads(instances):
+    """Read the payloads of `instances` in bulk, so delivering them
+    from other threads doesn't touch the database.
+
+    """
+    get_payloads([instance.payload_id for instance in instances
+                  if instance.payload_id])
+
+
 class NotificationInstance(models.Model):
     """The notification as it is sent to the provider"""
     notification = models.ForeignKey(Notification)
@@ -232,35 +451,336 @@ class NotificationInstance(models.Model):
     provider = models.CharField(max_length=20)
     # They must only contain valid json
     tokens = models.TextField()
-    data = models.TextField()
-    scheduled_at = models.DateTimeField(null=True)
+    # Empty if `payload` is set, instances created before payloads
+    # were stored apart keep their data here
+    data = models.TextField(default='', blank=True)
+    payload = models.ForeignKey(Payload, null=True, blank=True,
+                                on_delete=models.PROTECT)
+    scheduled_at = models.DateTimeField(null=True, db_index=True)
     canceled = models.BooleanField(default=False)
+    # Hash of `tokens`, used to find instances for the same tokens
+    fingerprint = models.CharField(max_length=40, default='', blank=True)
+    # Copied from the notification, used to choose the dispatch lane
+    priority = models.CharField(
+        max_length=20,
+        choices=PRIORITY_CHOICES, default=PRIORITY_HIGH)
+    # Copied from the notification, only the newest pending instance
+    # for the same tokens and collapse key is sent
+    collapse_key = models.CharField(max_length=255, default='', blank=True)
 
     # For the record, not needed at all
     timezone = TimeZoneField()
     sent_at = models.DateTimeField(null=True)
     result = models.TextField(default='', blank=True)
+    # Name of the worker that claimed the instance, see `sharding`
+    claimed_by = models.CharField(max_length=100, default='', blank=True)
+    # Set by the claim and renewed with every chunk sent, see `deliver`
+    claimed_at = models.DateTimeField(null=True)
+    # Set when the instance is created, see `sharding`
+    partition = models.PositiveSmallIntegerField(default=random_partition)
+    # Tokens already sent, see `deliver`
+    sent_tokens = models.PositiveIntegerField(default=0)
+    # The provider didn't accept it
+    failed = models.BooleanField(default=False)
+
+    class Meta:
+        index_together = (
+            ('notification', 'fingerprint', 'scheduled_at'),
+            ('fingerprint', 'collapse_key'),
+            ('partition', 'scheduled_at'),
+        )
+
+    def is_expired(self, now=None):
+        """True if `DJPUSH_NOTIFICATION_EXPIRES` seconds have passed since
+        `scheduled_at`
+
+        """
+        if NOTIFICATION_EXPIRES is None or self.scheduled_at is None:
+            return False
+        # `scheduled_at` is saved in UTC
+        now = now or datetime.datetime.utcnow()
+        expires = datetime.timedelta(seconds=NOTIFICATION_EXPIRES)
+        return self.scheduled_at + expires < now
+
+    def expire(self):
+        """Cancel the instance without sending it"""
+        self.canceled = True
+        self.result = 'expired'
+        cancel_instances(NotificationInstance.objects.filter(pk=self.pk),
+                         self.result)
+
+    def send(self, recorder=None):
+        """Send the notification and save the result. If `recorder` is
+        given the result is buffered by it (see
+        `dispatch.ResultRecorder`) instead of being saved now.
+
+        """
+        result = self.deliver()
+        if result is None:
+            return None
+        if recorder is None:
+            self.save(update_fields=('sent_at', 'result', 'failed'))
+            add_stats([self.get_stats_row()])
+        else:
+            recorder.record(self)
+
+        return result
 
-    def send(self):
+    def is_chunked(self):
+        """True if `deliver` sends the tokens in more than one chunk"""
+        return len(json.loads(self.tokens)) > DELIVERY_CHUNK_SIZE
+
+    def get_stats_row(self):
+        """The `add_stats` row of the sent instance"""
+        return (self.notification_id, self.provider, self.scheduled_at,
+                'failed' if self.failed else 'sent')
+
+    def get_data(self):
+        """The json sent to the provider"""
+        if self.payload_id is None:
+            return self.data
+        return get_payloads([self.payload_id])[self.payload_id]
+
+    def deliver(self):
+        """Call the provider and set `sent_at` and `result` without
+        saving. Return the provider response.
+
+        Tokens are sent in chunks of `DJPUSH_DELIVERY_CHUNK_SIZE`. If
+        there is more than one chunk `sent_tokens` is saved after each
+        of them accepted by the provider, so another attempt resumes
+        after the last accepted chunk, and a list of responses is
+        returned. A chunk that is not accepted, like a throttled one,
+        ends the delivery and the instance failed. `claimed_at` is
+        renewed with `sent_tokens` and the delivery stops, returning
+        `None`, if the instance was claimed by another worker meanwhile.
+        Saving them is the only time the database is touched, so it can
+        be called from other threads.
+
+        """
         if self.canceled:
             return None
         # Avoid sending the notification again
         if self.sent_at is not None:
             return None
-        notification = pypn.Notification(self.provider)
-        result = notification.send(json.loads(self.tokens),
-                                   json.loads(self.data))
+        provider = providers.get_provider(self.provider)
+        tokens = json.loads(self.tokens)
+        data = self.get_data()
+        if len(tokens) <= DELIVERY_CHUNK_SIZE:
+            response = provider.send(tokens, json.loads(data))
+            self.sent_at = datetime.datetime.now()
+            self.result = get_result(response)
+            self.failed = response.status_code != HTTP_OK
+            return response
+
+        responses = []
+        for start in range(self.sent_tokens, len(tokens), DELIVERY_CHUNK_SIZE):
+            # Providers could modify the data
+            response = provider.send(
+                tokens[start:start + DELIVERY_CHUNK_SIZE], json.loads(data))
+            responses.append(response)
+            if response.status_code != HTTP_OK:
+                # Not confirmed, the checkpoint stays before it
+                break
+            self.sent_tokens = min(start + DELIVERY_CHUNK_SIZE, len(tokens))
+            if self.pk is None:
+                continue
+            self.claimed_at = datetime.datetime.utcnow()
+            if not NotificationInstance.objects.filter(
+                    pk=self.pk, claimed_by=self.claimed_by
+            ).update(sent_tokens=self.sent_tokens,
+                     claimed_at=self.claimed_at):
+                # Resumed by another worker, it sends the rest
+                return None
         self.sent_at = datetime.datetime.now()
-        # This should be handled by pypn. `result` can be `None`,
-        # <str>, <requests.Response>(OneSignal) We only use OneSignal
-        # so we will consider it's a `Response` that contains json.
-        if result.status_code == requests.codes.ok:
-            self.result = result.json()
+        # Results of chunks sent by previous attempts are lost
+        self.result = [get_result(response) for response in responses]
+        self.failed = any(response.status_code != HTTP_OK
+                          for response in responses)
+        return responses
+
+
+def get_result(response):
+    # This should be handled by pypn. `result` can be `None`,
+    # <str>, <requests.Response>(OneSignal) We only use OneSignal
+    # so we will consider it's a `Response` that contains json.
+    if response.status_code == HTTP_OK:
+        return response.json()
+    return response.content
+
+
+def get_tokens_fingerprint(tokens):
+    """`tokens` is the json of the sorted list of tokens"""
+    return hashlib.sha1(tokens.encode()).hexdigest()
+
+
+def get_fingerprint_offset(fingerprint):
+    """A number in [0, 1) derived from `fingerprint`, see `schedulers`"""
+    return int(fingerprint[:8], 16) / 16 ** 8
+
+
+class NotificationStat(models.Model):
+    """Counters of the instances of a notification by provider and
+    day(of `scheduled_at`, in UTC). Kept up to date as instances are
+    scheduled, canceled and sent, see `add_stats`.
+    `stats.rebuild_stats` computes them again from the instances.
+
+    """
+    notification = models.ForeignKey(Notification)
+    # Copied from the notification
+    category = models.ForeignKey(NotificationCategory, null=True, blank=True,
+                                 on_delete=models.SET_NULL)
+    provider = models.CharField(max_length=20)
+    day = models.DateField()
+    scheduled = models.PositiveIntegerField(default=0)
+    canceled = models.PositiveIntegerField(default=0)
+    sent = models.PositiveIntegerField(default=0)
+    failed = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('notification', 'provider', 'day')
+
+    def __str__(self):
+        return '{} {} {}'.format(self.notification, self.provider, self.day)
+
+
+STAT_COUNTERS = ('scheduled', 'canceled', 'sent', 'failed')
+
+
+def add_stats(rows):
+    """Count `rows` of `(notification_id, provider, scheduled_at,
+    counter)` in `NotificationStat`, one `UPDATE` per notification,
+    provider and day. Rows without `scheduled_at` are not counted.
+
+    """
+    increments = defaultdict(Counter)
+    for notification_id, provider, scheduled_at, counter in rows:
+        if scheduled_at is not None:
+            key = (notification_id, provider, scheduled_at.date())
+            increments[key][counter] += 1
+    # Always in the same order to avoid deadlocks
+    for key in sorted(increments):
+        notification_id, provider, day = key
+        counts = increments[key]
+        stats = NotificationStat.objects.filter(
+            notification_id=notification_id, provider=provider, day=day)
+        changes = {name: models.F(name) + count
+                   for name, count in counts.items()}
+        if stats.update(**changes):
+            continue
+        category_id = Notification.objects.filter(
+            pk=notification_id).values_list('category_id', flat=True).first()
+        try:
+            with transaction.atomic():
+                NotificationStat.objects.create(
+                    notification_id=notification_id, category_id=category_id,
+                    provider=provider, day=day, **counts)
+        except IntegrityError:
+            # Created by a concurrent call
+            stats.update(**changes)
+
+
+def cancel_instances(instances, result='', stats=None):
+    """Cancel the pending instances of the `instances` queryset and
+    count them in the stats, or append their `add_stats` rows to the
+    `stats` list to count them later. Return the number of canceled
+    instances.
+
+    """
+    with transaction.atomic(savepoint=False):
+        rows = list(instances.filter(
+            sent_at__isnull=True, canceled=False
+        ).select_for_update().values_list(
+            'pk', 'notification_id', 'provider', 'scheduled_at'))
+        for chunk in chunked(rows, TOKENS_CHUNK_SIZE):
+            NotificationInstance.objects.filter(
+                pk__in=[row[0] for row in chunk]
+            ).update(canceled=True, result=result)
+        rows_stats = [
+            (notification_id, provider, scheduled_at, 'canceled')
+            for pk, notification_id, provider, scheduled_at in rows]
+        if stats is None:
+            add_stats(rows_stats)
         else:
-            self.result = result.content
-        self.save(update_fields=('sent_at', 'result'))
+            stats.extend(rows_stats)
+    return len(rows)
+
+
+class NotificationLock(models.Model):
+    """A row per notification and tokens fingerprint. Updated to lock
+    concurrent `schedule_notification` calls for the same notification
+    and tokens when the database has no advisory locks.
+
+    """
+    notification = models.ForeignKey(Notification)
+    fingerprint = models.CharField(max_length=40)
+    locked_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        unique_together = ('notification', 'fingerprint')
+
+
+def lock_notification(notification, fingerprint):
+    """Lock `notification` for `fingerprint` until the end of the
+    current transaction.
+
+    """
+    if connection.vendor == 'postgresql':
+        key = '{}:{}'.format(notification.pk, fingerprint).encode()
+        # Advisory locks use a signed 64 bits key
+        key = int.from_bytes(hashlib.sha1(key).digest()[:8], 'big',
+                             signed=True)
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_advisory_xact_lock(%s)', [key])
+        return
+    # Updating the row locks it. The lock is taken before any read so
+    # SQLite doesn't need to upgrade a shared lock later.
+    locks = NotificationLock.objects.filter(
+        notification=notification, fingerprint=fingerprint)
+    now = datetime.datetime.utcnow()
+    if locks.update(locked_at=now):
+        return
+    try:
+        with transaction.atomic():
+            NotificationLock.objects.create(
+                notification=notification, fingerprint=fingerprint,
+                locked_at=now)
+    except IntegrityError:
+        # Created by a concurrent call, wait for it
+        locks.update(locked_at=now)
+
+
+def prune_locks(now=None):
+    """Delete the `NotificationLock` rows unused for
+    `DJPUSH_LOCK_RETENTION` seconds, they are created again when needed.
+    Return the number of deleted rows.
+
+    """
+    now = now or datetime.datetime.utcnow()
+    unused_since = now - datetime.timedelta(seconds=LOCK_RETENTION)
+    deleted, _ = NotificationLock.objects.filter(
+        locked_at__lt=unused_since).delete()
+    return deleted
+
+
+class DispatchWorker(models.Model):
+    """A process sending notifications, see `sharding`"""
+    name = models.CharField(max_length=100, unique=True)
+    heartbeat_at = models.DateTimeField()
+
+    def __str__(self):
+        return self.name
 
-        return result
+
+class PartitionLease(models.Model):
+    """Instances of `partition` are sent by `owner` until `expires_at`
+
+    """
+    partition = models.IntegerField(unique=True)
+    owner = models.CharField(max_length=100, default='', blank=True)
+    expires_at = models.DateTimeField(null=True)
+
+    def __str__(self):
+        return 'Partition {} owned by {}'.format(self.partition, self.owner)
 
 
 class Scheduler(models.Model):
@@ -287,14 +807,17 @@ class Scheduler(models.Model):
                 pass
         return obj
 
-    def get_schedule(self, now):
+    def get_schedule(self, now, offset=0):
+        """`offset` is passed to the scheduler, see `schedulers`"""
         scheduler = self.get_child_scheduler()
         # If no scheduler we schedule for `now`
         if scheduler is None:
             return now
-        schedule = scheduler.scheduler_class(
-            *scheduler.get_scheduler_args())(now)
-        return schedule
+        scheduler = scheduler.scheduler_class(
+            *scheduler.get_scheduler_args())
+        if offset:
+            return scheduler(now, offset)
+        return scheduler(now)
 
 
 class SchedulerInTimeRange(Scheduler):
@@ -310,13 +833,20 @@ class SchedulerInTimeRange(Scheduler):
     discard = models.BooleanField(
         default=False, help_text="If checked the notification will be "
         "discarded instead of being scheduling to be sent later")
+    ramp_minutes = models.IntegerField(
+        default=0,
+        validators=[MinValueValidator(0)],
+        help_text="Notifications scheduled for the start hour are spread "
+                  "over these minutes. The same tokens always get the same "
+                  "delay")
 
     def __str__(self):
         return 'Schedule between {} and {} (discard {})'.format(
             self.start_hour, self.end_hour, self.discard)
 
     def get_scheduler_args(self):
-        return self.start_hour, self.end_hour, self.discard
+        return (self.start_hour, self.end_hour, self.discard,
+                self.ramp_minutes * 60)
 
 
 class SchedulerMinutesLater(Scheduler):
@@ -330,74 +860,155 @@ class SchedulerMinutesLater(Scheduler):
         return (self.minutes, )
 
 
-def schedule_notification(timezone, slug, tokens, context=None, provider=None):
-    # We sort `tokens` to be sure they will be equal if the same
-    # notification is scheduled again. Required to cancel other
-    # notifications later.
-    tokens = json.dumps(sorted(tokens))
-    provider = provider or DEFAULT_PROVIDER
+def get_notification(slug, using=None):
+    """The enabled notification for `slug` read from `using`, or the
+    database chosen by the routers. If it's not found in a replica it's
+    read again from the primary(`DEFAULT_DB_ALIAS`), it could be
+    lagging.
+
+    """
+    notifications = Notification.objects.select_related(
+        'category').filter(slug=slug, enabled=True)
+    using = using or router.db_for_read(Notification)
     try:
-        notification = Notification.objects.get(slug=slug, enabled=True)
+        return notifications.using(using).get()
     except Notification.DoesNotExist:
-        return None
+        # Not `db_for_write`, routers could pin reads to the primary
+        if using == DEFAULT_DB_ALIAS:
+            raise
+    return notifications.using(DEFAULT_DB_ALIAS).get()
+
 
+def get_schedule(schedulers, timezone, offset=0):
+    """Apply `schedulers`, `NotificationScheduler` instances, to the
+    current time in `timezone`. Return it in UTC without timezone, or
+    `None` if a scheduler discards the notification.
+
+    """
     # Apply the timezone
     schedule = datetime.datetime.now(timezone)
     # Apply notification schedulers
-    schedulers = notification.notificationscheduler_set.all().order_by('order')
     for scheduler in schedulers:
-        schedule = scheduler.scheduler.get_schedule(schedule)
+        schedule = scheduler.scheduler.get_schedule(schedule, offset)
+    if schedule is None:
+        return None
     # Remove the timezone. `utctimetuple` returns (2017, 3, 8, 14, 42,
     # 21, 2, 67, 0) so from the beginning to the 5th element is from
     # year to seconds
     TO_SECONDS = 6
-    if schedule is not None:
-        schedule = datetime.datetime(*schedule.utctimetuple()[:TO_SECONDS])
+    return datetime.datetime(*schedule.utctimetuple()[:TO_SECONDS])
+
+
+def schedule_notification(timezone, slug, tokens, context=None, provider=None,
+                          languages=None, using=None, executor=None):
+    """Schedule the notification `slug` for `tokens`. The notification
+    and its schedulers are read from `using`, or the database chosen by
+    the routers. Instances are always read and written in the primary.
+    The instance is submitted to `executor`, by default the one in
+    `DJPUSH_EXECUTOR`.
+
+    """
+    provider = provider or providers.get_default_provider()
+    try:
+        notification = get_notification(slug, using)
+    except Notification.DoesNotExist:
+        return None
+
+    # Any iterable, it's read more than once
+    tokens = list(tokens)
+    # Remove tokens that opted-out the notification category
+    category = notification.category
+    if category is not None and category.opt_out:
+        opted_out = get_opted_out(category, tokens)
+        if opted_out:
+            tokens = [token for token in tokens if token not in opted_out]
+        if not tokens:
+            return None
+
+    # We sort `tokens` to be sure they will be equal if the same
+    # notification is scheduled again. Required to cancel other
+    # notifications later.
+    tokens = json.dumps(sorted(tokens))
+    fingerprint = get_tokens_fingerprint(tokens)
+    # Schedules spread by the schedulers are the same for the same
+    # tokens, so the range checked below still contains previous
+    # instances for them
+    offset = get_fingerprint_offset(fingerprint)
+
+    # Read with the notification, so a lagging replica can't return
+    # part of them
+    schedulers = list(notification.notificationscheduler_set.using(
+        notification._state.db).select_related(
+        'scheduler__schedulerintimerange',
+        'scheduler__schedulerminuteslater').order_by('order'))
     # We discard the notification when `delay` equals to `None`
-    if schedule is None:
+    if get_schedule(schedulers, timezone, offset) is None:
         return None
 
+    # Rendered and stored before locking to keep the lock short. Keys
+    # are sorted so equal payloads get the same digest.
+    data = json.dumps(notification.as_dict(context, languages=languages),
+                      sort_keys=True)
+    payload_id, = save_payloads([data])
+
     # Check for instances with the same `notification` and `tokens` in
     # the same period(between `now` and `schedule`). If none has been
     # sent cancel all of them and schedule current. If any was sent
-    # cancel all others and don't schedule current.
-    start_date = datetime.datetime.now()
-    instances = NotificationInstance.objects.select_for_update(
-    ).filter(
-        notification=notification,
-        tokens=tokens,
-        scheduled_at__range=(start_date, schedule)
-    )
-    any_sent = instances.exclude(
-        sent_at__isnull=True
-    ).count()
-    if any_sent:
-        instances.filter(
-            sent_at__isnull=True
-        ).update(
-            canceled=True)
-        # Already sent, we don't schedule
+    # cancel all others and don't schedule current. Concurrent calls
+    # for the same notification and tokens wait for the lock.
+    # Counted once the lock is released, the stats of the day are
+    # shared by every call for the notification
+    stats = []
+    with transaction.atomic():
+        lock_notification(notification, fingerprint)
+        # Computed again once locked, so concurrent calls get their
+        # schedules in lock order and each one sees the previous ones
+        schedule = get_schedule(schedulers, timezone, offset)
+        if schedule is None:
+            return None
+        start_date = datetime.datetime.utcnow()
+        instances = NotificationInstance.objects.filter(
+            notification=notification,
+            fingerprint=fingerprint,
+            scheduled_at__range=(start_date, schedule)
+        )
+        # Partially sent instances are finished, not replaced
+        started = (models.Q(sent_at__isnull=False) |
+                   models.Q(sent_tokens__gt=0))
+        if instances.filter(started).exists():
+            cancel_instances(instances.exclude(started), stats=stats)
+            # Already sent, we don't schedule
+            notification_instance = None
+        else:
+            # Cancel other not sent notifications
+            cancel_instances(instances, stats=stats)
+
+            # Schedule new notification
+            notification_instance = NotificationInstance.objects.create(
+                notification=notification,
+                # data is not the same as notification.data, if dynamic
+                # values or translation is applied
+                payload_id=payload_id,
+                provider=provider,
+                tokens=tokens,
+                fingerprint=fingerprint,
+                priority=notification.priority,
+                collapse_key=notification.gcm_option_collapse_key,
+                timezone=timezone,
+                scheduled_at=schedule,
+            )
+            stats.append((notification.pk, provider, schedule, 'scheduled'))
+    add_stats(stats)
+    if notification_instance is None:
         return None
-    else:
-        # Cancel other not sent notifications
-        instances.update(canceled=True)
-
-    # Schedule new notification
-    data = json.dumps(notification.as_dict(context))
-    notification_instance = NotificationInstance.objects.create(
-        notification=notification,
-        # data is not the same as notification.data, if dynamic values
-        # or translation is applied
-        data=data,
-        provider=provider,
-        tokens=tokens,
-        timezone=timezone,
-        scheduled_at=schedule,
-    )
 
     # We round because `total_seconds` returns a `float`
-    delay = round((schedule - datetime.datetime.now()).total_seconds())
+    delay = round((schedule - datetime.datetime.utcnow()).total_seconds())
     kwargs = SEND_NOTIFICATION_KWARGS.copy()
     kwargs.update({'countdown': delay})
-    result = notification_instance.send()
-    return result
+    if executor is None:
+        # Imported here because executors import this module
+        from .executors import get_executor
+        executor = get_executor()
+    executor.submit(notification_instance, **kwargs)
+    return notification_instance
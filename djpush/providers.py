@@ -0,0 +1,88 @@
+"""Provider backends, loaded the first time they are used.
+
+A provider is an object with a `send(tokens, data)` method. Providers
+are found by name in `register`ed providers, the `DJPUSH_PROVIDERS`
+setting(a dict of names and dotted paths) and the `djpush.providers`
+entry point group, in that order. Any other name is sent with pypn.
+
+"""
+import threading
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.module_loading import import_string
+
+
+ENTRY_POINT_GROUP = 'djpush.providers'
+
+_registry = {}
+_providers = {}
+_lock = threading.Lock()
+
+
+class PypnProvider:
+    """Send with the pypn provider `name`"""
+    def __init__(self, name):
+        self.name = name
+
+    def send(self, tokens, data):
+        import pypn
+        return pypn.Notification(self.name).send(tokens, data)
+
+
+def register(name, provider):
+    """`provider` is a class, a factory or the dotted path of one of
+    them. It's called without arguments the first time it's used.
+
+    """
+    with _lock:
+        _registry[name] = provider
+        _providers.pop(name, None)
+
+
+def get_provider(name):
+    try:
+        return _providers[name]
+    except KeyError:
+        pass
+    with _lock:
+        if name not in _providers:
+            _providers[name] = _load(name)
+        return _providers[name]
+
+
+def _load(name):
+    factory = _registry.get(name)
+    if factory is None:
+        factory = getattr(settings, 'DJPUSH_PROVIDERS', {}).get(name)
+    if factory is None:
+        factory = _load_entry_point(name)
+    if factory is None:
+        return PypnProvider(name)
+    if isinstance(factory, str):
+        try:
+            factory = import_string(factory)
+        except ImportError as e:
+            raise ImproperlyConfigured(
+                'Provider "%s" could not be imported: %s' % (name, e))
+    return factory()
+
+
+def _load_entry_point(name):
+    try:
+        import pkg_resources
+    except ImportError:
+        return None
+    for entry_point in pkg_resources.iter_entry_points(ENTRY_POINT_GROUP,
+                                                       name):
+        return entry_point.load()
+    return None
+
+
+def get_default_provider():
+    provider = getattr(settings, 'DJPUSH_DEFAULT_PROVIDER', None)
+    if provider is None:
+        raise ImproperlyConfigured(
+            'A default notification provider is required. '
+            'Check README for details.')
+    return provider
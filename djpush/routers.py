@@ -0,0 +1,72 @@
+"""Database router sending reads of notification definitions to a
+replica. Add it to `DATABASE_ROUTERS` and set `DJPUSH_REPLICA_DATABASE`
+to the replica alias.
+
+Instances, opt-outs, locks and payloads are always read from the
+primary: they are used to deduplicate and to know what was sent, so
+they can't lag. After writing a definition the thread reads
+definitions from the primary for `DJPUSH_REPLICA_PIN_SECONDS`, to see
+its own writes.
+
+"""
+import threading
+import time
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+
+REPLICA_DATABASE = getattr(settings, 'DJPUSH_REPLICA_DATABASE', None)
+REPLICA_PIN_SECONDS = getattr(settings, 'DJPUSH_REPLICA_PIN_SECONDS', 5)
+# Rarely written, a lagging replica only delays changes
+REPLICA_MODELS = {
+    'notification',
+    'notificationcategory',
+    'notificationscheduler',
+    'scheduler',
+    'schedulerintimerange',
+    'schedulerminuteslater',
+}
+
+
+class ReplicaRouter:
+    def __init__(self, replica=None, pin_seconds=None, clock=time.monotonic):
+        self.replica = replica or REPLICA_DATABASE
+        if pin_seconds is None:
+            pin_seconds = REPLICA_PIN_SECONDS
+        self.pin_seconds = pin_seconds
+        self.clock = clock
+        self._local = threading.local()
+
+    def is_pinned(self):
+        pinned_until = getattr(self._local, 'pinned_until', None)
+        return pinned_until is not None and self.clock() < pinned_until
+
+    def pin(self):
+        """Read definitions from the primary for `pin_seconds`"""
+        self._local.pinned_until = self.clock() + self.pin_seconds
+
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label != 'djpush' or not self.replica:
+            return None
+        if model._meta.model_name not in REPLICA_MODELS:
+            return DEFAULT_DB_ALIAS
+        if self.is_pinned():
+            return DEFAULT_DB_ALIAS
+        return self.replica
+
+    def db_for_write(self, model, **hints):
+        if model._meta.app_label != 'djpush' or not self.replica:
+            return None
+        if model._meta.model_name in REPLICA_MODELS:
+            self.pin()
+        # Even for objects read from the replica
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Definitions read from the replica are related to rows in the
+        # primary
+        if (obj1._meta.app_label == 'djpush' and
+                obj2._meta.app_label == 'djpush'):
+            return True
+        return None
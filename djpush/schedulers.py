@@ -2,6 +2,8 @@ import datetime
 
 
 # Schedulers return the `datetime.datetime` a task should be scheduled.
+# `offset` is a number in [0, 1) fixed for the task tokens, used to
+# spread tasks scheduled at the same time.
 
 
 class SchedulerMinutesLater:
@@ -10,7 +12,7 @@ class SchedulerMinutesLater:
     def __init__(self, minutes=0):
         self.minutes = minutes
 
-    def __call__(self, now):
+    def __call__(self, now, offset=0):
         return now + datetime.timedelta(minutes=self.minutes)
 
 
@@ -21,13 +23,18 @@ class SchedulerInTimeRange:
     `now` is 7 the result is today at `lower_limit`. If `now` is 23
     the result is tomorrow at `lower_limit`.
 
+    Tasks moved to `lower_limit` are spread over the next `ramp`
+    seconds according to `offset`, so they don't all get due in the
+    same second.
+
     """
-    def __init__(self, start_hour, end_hour, discard):
+    def __init__(self, start_hour, end_hour, discard, ramp=0):
         self.start_hour = start_hour
         self.end_hour = end_hour
         self.discard = discard
+        self.ramp = ramp
 
-    def __call__(self, now):
+    def __call__(self, now, offset=0):
         # It's too early
         if now.hour < self.start_hour:
             days = 0
@@ -45,4 +52,8 @@ class SchedulerInTimeRange:
         delta = datetime.timedelta(days=days)
         tomorrow = now + delta
         tomorrow_at = tomorrow.replace(hour=self.start_hour, minute=0, second=0)
+        # Never ramp past the end of the range
+        ramp = min(self.ramp, (self.end_hour - self.start_hour) * 3600 - 1)
+        if ramp > 0:
+            tomorrow_at += datetime.timedelta(seconds=int(ramp * offset))
         return tomorrow_at
@@ -0,0 +1,168 @@
+import datetime
+import math
+import os
+import socket
+import uuid
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F, Q
+
+from .models import (PARTITIONS, DispatchWorker, NotificationInstance,
+                     PartitionLease, chunked)
+
+
+# Instances get one of `PARTITIONS` partitions when they are created.
+# Each worker leases about `PARTITIONS / live workers` of them for
+# `LEASE_DURATION` seconds and renews the leases with every heartbeat.
+# Heartbeats must be more frequent than `LEASE_DURATION`.
+LEASE_DURATION = getattr(settings, 'DJPUSH_LEASE_DURATION', 30)
+
+
+class Coordinator:
+    """Lease partitions of the instances to the current worker. Workers
+    joining or dying are noticed on the next heartbeat, partitions over
+    the fair share are released and free or expired ones are claimed.
+
+    """
+    def __init__(self, name=None, partitions=None, lease_duration=None):
+        self.name = name or '{}-{}-{}'.format(
+            socket.gethostname(), os.getpid(), uuid.uuid4().hex[:8])
+        self.partitions = partitions or PARTITIONS
+        self.lease_duration = datetime.timedelta(
+            seconds=lease_duration or LEASE_DURATION)
+        self.owned = set()
+
+    def heartbeat(self, now=None):
+        """Register the worker and renew, release or claim leases.
+        Return the owned partitions.
+
+        """
+        now = now or datetime.datetime.utcnow()
+        expires_at = now + self.lease_duration
+        DispatchWorker.objects.update_or_create(
+            name=self.name, defaults={'heartbeat_at': now})
+        self._create_partitions()
+
+        # Renew
+        leases = PartitionLease.objects.filter(
+            owner=self.name, expires_at__gte=now,
+            partition__lt=self.partitions)
+        leases.update(expires_at=expires_at)
+        self.owned = set(leases.values_list('partition', flat=True))
+
+        live_workers = DispatchWorker.objects.filter(
+            heartbeat_at__gte=now - self.lease_duration).count()
+        share = int(math.ceil(self.partitions / max(live_workers, 1)))
+
+        if len(self.owned) > share:
+            extra = sorted(self.owned)[share:]
+            PartitionLease.objects.filter(
+                owner=self.name, partition__in=extra
+            ).update(owner='', expires_at=None)
+            self.owned.difference_update(extra)
+        elif len(self.owned) < share:
+            available = PartitionLease.objects.filter(
+                Q(owner='') | Q(expires_at__lt=now),
+                partition__lt=self.partitions,
+            )
+            candidates = list(available.values_list('partition', flat=True)[
+                :share - len(self.owned)])
+            for partition in candidates:
+                # Another worker could claim it first
+                if available.filter(partition=partition).update(
+                        owner=self.name, expires_at=expires_at):
+                    self.owned.add(partition)
+
+        # Forget workers that died long ago
+        DispatchWorker.objects.filter(
+            heartbeat_at__lt=now - 10 * self.lease_duration).delete()
+        return self.owned
+
+    def unregister(self):
+        PartitionLease.objects.filter(owner=self.name).update(
+            owner='', expires_at=None)
+        DispatchWorker.objects.filter(name=self.name).delete()
+        self.owned = set()
+
+    def _create_partitions(self):
+        existing = set(PartitionLease.objects.values_list(
+            'partition', flat=True))
+        missing = set(range(self.partitions)) - existing
+        if not missing:
+            return
+        try:
+            with transaction.atomic():
+                PartitionLease.objects.bulk_create(
+                    [PartitionLease(partition=partition)
+                     for partition in sorted(missing)])
+        except IntegrityError:
+            # Created by another worker
+            pass
+
+    def filter(self, instances):
+        """Restrict the `instances` queryset to the owned partitions"""
+        # Partitions of the instances created with another number of
+        # partitions are split again, the same way
+        partitions = [partition for partition in range(PARTITIONS)
+                      if partition % self.partitions in self.owned]
+        return instances.annotate(
+            current_partition=F('partition') % self.partitions
+        ).filter(
+            Q(partition__in=partitions) |
+            Q(partition__gte=PARTITIONS,
+              current_partition__in=sorted(self.owned)))
+
+    def claim(self, instances, now=None):
+        """Mark `instances` as sent by this worker before calling the
+        provider. Return the claimed instances, others were canceled or
+        sent by another worker meanwhile. If the worker dies during a
+        chunked delivery `resume` lets the next owner finish it.
+
+        """
+        now = now or datetime.datetime.utcnow()
+        claimed = set()
+        for chunk in chunked([instance.pk for instance in instances], 500):
+            NotificationInstance.objects.filter(
+                pk__in=chunk, sent_at__isnull=True, canceled=False
+            ).update(sent_at=now, claimed_by=self.name, claimed_at=now)
+            claimed.update(NotificationInstance.objects.filter(
+                pk__in=chunk, claimed_by=self.name
+            ).values_list('pk', flat=True))
+        return [instance for instance in instances if instance.pk in claimed]
+
+    def resume(self, now=None):
+        """Claim the instances of the owned partitions that dead workers
+        claimed and didn't finish delivering in chunks(see
+        `NotificationInstance.deliver`). Return them ready to be
+        delivered again, from their last accepted chunk. Only instances
+        without a chunk sent for `lease_duration` are resumed, a worker
+        still sending them stops when it notices. Others claimed by dead
+        workers could have been sent, they are not sent again.
+
+        """
+        now = now or datetime.datetime.utcnow()
+        live_workers = DispatchWorker.objects.filter(
+            heartbeat_at__gte=now - self.lease_duration
+        ).values_list('name', flat=True)
+        stalled = (Q(claimed_at__isnull=True) |
+                   Q(claimed_at__lt=now - self.lease_duration))
+        unfinished = self.filter(NotificationInstance.objects.filter(
+            stalled, sent_at__isnull=False, result='', canceled=False,
+        ).exclude(claimed_by='').exclude(claimed_by__in=live_workers))
+        resumed = []
+        for instance in unfinished:
+            if not instance.is_chunked():
+                continue
+            # Another worker could resume it first, or the delivery
+            # could send a chunk meanwhile
+            if NotificationInstance.objects.filter(
+                    stalled, pk=instance.pk, claimed_by=instance.claimed_by,
+                    result=''
+            ).update(sent_at=now, claimed_by=self.name, claimed_at=now):
+                # Not sent yet for `deliver`
+                instance.sent_at = None
+                instance.claimed_by = self.name
+                instance.claimed_at = now
+                resumed.append(instance)
+        return resumed
@@ -0,0 +1,73 @@
+"""Delivery statistics. `NotificationStat` rows are updated by djpush
+as instances are scheduled, canceled and sent, these functions read
+them and build them again from the instances.
+
+"""
+import datetime
+
+from django.db import transaction
+from django.db.models import Case, Count, IntegerField, Q, Sum, When
+from django.db.models.functions import TruncDate
+
+from .models import (STAT_COUNTERS, NotificationInstance, NotificationStat,
+                     chunked)
+
+
+def get_stats(start=None, end=None, group_by=('notification', 'day'),
+              **filters):
+    """Counters added by `group_by`, any `NotificationStat` field or
+    lookup like `notification__slug`, for the days between `start` and
+    `end` included. `filters` are passed to `filter`. Return a list of
+    dicts ordered by `group_by`.
+
+    """
+    stats = NotificationStat.objects.filter(**filters)
+    if start is not None:
+        stats = stats.filter(day__gte=start)
+    if end is not None:
+        stats = stats.filter(day__lte=end)
+    return list(stats.values(*group_by).annotate(
+        **{name: Sum(name) for name in STAT_COUNTERS}
+    ).order_by(*group_by))
+
+
+def count_if(condition):
+    return Sum(Case(When(condition, then=1), default=0,
+                    output_field=IntegerField()))
+
+
+def rebuild_stats(start=None):
+    """Replace the stats of the days since `start`, or all of them, with
+    counters computed from the instances. Return the number of rows.
+
+    """
+    instances = NotificationInstance.objects.filter(scheduled_at__isnull=False)
+    stats = NotificationStat.objects.all()
+    if start is not None:
+        start_at = datetime.datetime.combine(start, datetime.time())
+        instances = instances.filter(scheduled_at__gte=start_at)
+        stats = stats.filter(day__gte=start)
+    sent = Q(sent_at__isnull=False) & ~Q(result='')
+    with transaction.atomic():
+        rows = instances.annotate(
+            day=TruncDate('scheduled_at')
+        ).order_by().values(
+            'notification', 'notification__category', 'provider', 'day'
+        ).annotate(
+            # Named apart from the instance fields
+            stat_scheduled=Count('pk'),
+            stat_canceled=count_if(Q(canceled=True, sent_at__isnull=True)),
+            stat_sent=count_if(sent & Q(failed=False)),
+            stat_failed=count_if(sent & Q(failed=True)),
+        )
+        rows = [NotificationStat(
+            notification_id=row['notification'],
+            category_id=row['notification__category'],
+            provider=row['provider'],
+            day=row['day'],
+            **{name: row['stat_' + name] for name in STAT_COUNTERS})
+            for row in rows]
+        stats.delete()
+        for chunk in chunked(rows, 100):
+            NotificationStat.objects.bulk_create(chunk)
+    return len(rows)
@@ -0,0 +1,9 @@
+# Celery tasks, only available if celery is installed
+from celery import shared_task
+
+from .executors import deliver_instance
+
+
+@shared_task(ignore_result=True)
+def send_notification_instance(pk):
+    deliver_instance(pk)
@@ -0,0 +1,124 @@
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+import asyncio
+import threading
+import time
+
+from django.test import TestCase, TransactionTestCase
+import pytz
+
+from . import aio, executors, models
+
+
+class RecordingExecutor:
+    def __init__(self):
+        self.submitted = []
+
+    def submit(self, instance, countdown=0, expires=None):
+        self.submitted.append(instance.pk)
+
+
+def slow_send(*args):
+    time.sleep(1)
+    raise AssertionError('The provider must not be called')
+
+
+@mock.patch('pypn.Notification.send', side_effect=slow_send)
+class AsyncScheduleTestCase(TransactionTestCase):
+    def setUp(self):
+        models.Notification.objects.create(slug='a-slug', enabled=True)
+        self.executor = RecordingExecutor()
+        patcher = mock.patch(
+            'djpush.aio.get_async_executor', return_value=self.executor)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        # The SQLite test database doesn't take concurrent writes
+        pool = ThreadPoolExecutor(1)
+        self.addCleanup(pool.shutdown)
+        patcher = mock.patch('djpush.aio._pool', pool)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+
+    def test_schedule(self, mock_send):
+        instance = self.loop.run_until_complete(
+            aio.aschedule_notification(pytz.utc, 'a-slug', ['token']))
+
+        self.assertEqual(self.executor.submitted, [instance.pk])
+        self.assertIsNone(self.loop.run_until_complete(
+            aio.aschedule_notification(pytz.utc, 'another-slug', ['token'])))
+
+    def test_concurrent_calls(self, mock_send):
+        # A starved default executor doesn't delay scheduling
+        blocked = threading.Event()
+        default = ThreadPoolExecutor(1)
+        self.addCleanup(default.shutdown)
+        self.addCleanup(blocked.set)
+        self.loop.set_default_executor(default)
+        self.loop.run_in_executor(None, blocked.wait)
+        gaps = []
+
+        async def heartbeat(done):
+            last = time.monotonic()
+            while not done.is_set():
+                await asyncio.sleep(0.01)
+                now = time.monotonic()
+                gaps.append(now - last)
+                last = now
+
+        async def run():
+            done = asyncio.Event()
+            beat = asyncio.ensure_future(heartbeat(done))
+            results = await asyncio.gather(*[
+                aio.aschedule_notification(
+                    pytz.utc, 'a-slug', ['token{}'.format(i)])
+                for i in range(50)])
+            done.set()
+            await beat
+            return results
+
+        start = time.monotonic()
+        results = self.loop.run_until_complete(asyncio.wait_for(run(), 30))
+
+        self.assertLess(time.monotonic() - start, 10)
+        self.assertEqual(
+            sorted(self.executor.submitted),
+            sorted(instance.pk for instance in results))
+        self.assertEqual(models.NotificationInstance.objects.count(), 50)
+        self.assertFalse(mock_send.called)
+        # The loop kept running meanwhile
+        self.assertLess(max(gaps), 1)
+
+    def test_bulk(self, mock_send):
+        notifications = [
+            {'timezone': pytz.utc, 'slug': 'a-slug',
+             'tokens': ['token{}'.format(i)]}
+            for i in range(150)]
+        notifications.append({'timezone': pytz.utc, 'slug': 'another-slug',
+                              'tokens': ['token']})
+
+        results = self.loop.run_until_complete(
+            aio.aschedule_notifications(notifications))
+
+        self.assertEqual(len(results), 151)
+        self.assertIsNone(results[-1])
+        self.assertEqual(
+            self.executor.submitted,
+            [instance.pk for instance in results[:-1]])
+        self.assertEqual([instance.tokens for instance in results[:3]],
+                         ['["token0"]', '["token1"]', '["token2"]'])
+
+
+class AsyncExecutorTestCase(TestCase):
+    @mock.patch('djpush.aio._executor', None)
+    def test_sync_replaced(self):
+        with mock.patch(
+                'djpush.aio.get_executor',
+                return_value=executors.SyncExecutor()):
+            self.assertIsInstance(
+                aio.get_async_executor(), executors.ThreadExecutor)
+        celery = executors.CeleryExecutor(task=mock.Mock())
+        with mock.patch('djpush.aio.get_executor', return_value=celery):
+            self.assertIs(aio.get_async_executor(), celery)
+
@@ -0,0 +1,251 @@
+import datetime
+from unittest import mock
+
+from django.test import TestCase
+import pypn
+import pytz
+
+from . import dispatch, models
+from .test_helpers import response
+
+
+class ResultRecorderTestCase(TestCase):
+    def setUp(self):
+        self.notification = models.Notification.objects.create(
+            slug='a-slug', enabled=True)
+        self.instances = [
+            models.NotificationInstance.objects.create(
+                notification=self.notification, tokens='["token"]', data='{}',
+                provider=pypn.DUMMY)
+            for i in range(3)]
+        self.now = datetime.datetime(2017, 3, 8, 14, 42)
+        for instance in self.instances:
+            instance.sent_at = self.now
+            instance.result = 'ok'
+
+    def test_flush(self):
+        recorder = dispatch.ResultRecorder(batch_size=10)
+        for instance in self.instances:
+            recorder.record(instance)
+        self.assertFalse(
+            models.NotificationInstance.objects.filter(
+                sent_at__isnull=False).exists())
+
+        with self.assertNumQueries(1):
+            updated = recorder.flush()
+
+        self.assertEqual(updated, 3)
+        self.assertEqual(
+            models.NotificationInstance.objects.filter(
+                sent_at=self.now, result='ok').count(),
+            3)
+
+    def test_batch_size(self):
+        recorder = dispatch.ResultRecorder(batch_size=2)
+        for instance in self.instances:
+            recorder.record(instance)
+
+        self.assertEqual(len(recorder), 1)
+        self.assertEqual(
+            models.NotificationInstance.objects.filter(
+                sent_at__isnull=False).count(),
+            2)
+
+    def test_flush_interval(self):
+        recorder = dispatch.ResultRecorder(batch_size=10, flush_interval=0)
+        recorder.record(self.instances[0])
+
+        self.assertEqual(len(recorder), 0)
+
+    def test_recorded_once(self):
+        recorder = dispatch.ResultRecorder(batch_size=10)
+        self.assertTrue(recorder.record(self.instances[0]))
+        self.assertFalse(recorder.record(self.instances[0]))
+        models.NotificationInstance.objects.filter(
+            pk=self.instances[1].pk
+        ).update(sent_at=self.now, result='first')
+        recorder.record(self.instances[1])
+
+        self.assertEqual(recorder.flush(), 1)
+        self.assertEqual(
+            models.NotificationInstance.objects.get(
+                pk=self.instances[1].pk).result,
+            'first')
+
+
+@mock.patch('pypn.Notification.send', side_effect=lambda *args: response())
+class DispatchDueTestCase(TestCase):
+    def setUp(self):
+        notification = models.Notification.objects.create(
+            slug='a-slug', enabled=True)
+        now = datetime.datetime.utcnow()
+        self.due = [
+            models.NotificationInstance.objects.create(
+                notification=notification, tokens='["token"]', data='{}',
+                provider=pypn.DUMMY,
+                scheduled_at=now - datetime.timedelta(seconds=i))
+            for i in range(4)]
+        self.later = models.NotificationInstance.objects.create(
+            notification=notification, tokens='["token"]', data='{}',
+            provider=pypn.DUMMY,
+            scheduled_at=now + datetime.timedelta(hours=1))
+        models.NotificationInstance.objects.create(
+            notification=notification, tokens='["token"]', data='{}',
+            provider=pypn.DUMMY,
+            scheduled_at=now, canceled=True)
+
+    def test_dispatch(self, mock_send):
+        for day in {instance.scheduled_at.date() for instance in self.due}:
+            models.NotificationStat.objects.create(
+                notification=self.due[0].notification, provider=pypn.DUMMY,
+                day=day)
+
+        # Select plus one update, and the stats
+        with self.assertNumQueries(
+                2 + models.NotificationStat.objects.count()):
+            sent = dispatch.dispatch_due()
+
+        self.assertEqual(sent, 4)
+        self.assertEqual(mock_send.call_count, 4)
+        self.assertEqual(
+            models.NotificationInstance.objects.filter(
+                sent_at__isnull=False).count(),
+            4)
+        self.assertIsNone(
+            models.NotificationInstance.objects.get(pk=self.later.pk).sent_at)
+
+    def test_dispatch_workers(self, mock_send):
+        sent = dispatch.dispatch_due(workers=3)
+
+        self.assertEqual(sent, 4)
+        self.assertEqual(
+            models.NotificationInstance.objects.filter(
+                sent_at__isnull=False).count(),
+            4)
+
+    def test_dispatch_recorder(self, mock_send):
+        recorder = dispatch.ResultRecorder(batch_size=10)
+
+        dispatch.dispatch_due(recorder=recorder)
+
+        self.assertEqual(len(recorder), 0)
+        self.assertEqual(
+            models.NotificationInstance.objects.filter(
+                sent_at__isnull=False).count(),
+            4)
+
+    def test_dispatch_twice(self, mock_send):
+        dispatch.dispatch_due()
+
+        self.assertEqual(dispatch.dispatch_due(), 0)
+        self.assertEqual(mock_send.call_count, 4)
+
+    def test_dispatch_twice_recorder(self, mock_send):
+        # Like `djpush_dispatch --interval`
+        recorder = dispatch.ResultRecorder(batch_size=10, flush_interval=60)
+
+        dispatch.dispatch_due(recorder=recorder)
+
+        self.assertEqual(dispatch.dispatch_due(recorder=recorder), 0)
+        self.assertEqual(mock_send.call_count, 4)
+
+    def test_dispatch_rate_limited(self, mock_send):
+        now = [0]
+        rate_limiter = dispatch.RateLimiter(2, clock=lambda: now[0])
+
+        self.assertEqual(dispatch.dispatch_due(rate_limiter=rate_limiter), 2)
+        self.assertEqual(dispatch.dispatch_due(rate_limiter=rate_limiter), 0)
+        now[0] = 0.5
+        self.assertEqual(dispatch.dispatch_due(rate_limiter=rate_limiter), 1)
+        now[0] = 10
+        self.assertEqual(dispatch.dispatch_due(rate_limiter=rate_limiter), 1)
+
+
+class RateLimiterTestCase(TestCase):
+    def test_refill(self):
+        now = [0]
+        rate_limiter = dispatch.RateLimiter(10, burst=20, clock=lambda: now[0])
+
+        self.assertEqual(rate_limiter.available(), 20)
+        rate_limiter.consume(20)
+        self.assertEqual(rate_limiter.available(), 0)
+        now[0] = 0.5
+        self.assertEqual(rate_limiter.available(), 5)
+        now[0] = 100
+        self.assertEqual(rate_limiter.available(), 20)
+
+    def test_get_rate_limiter(self):
+        self.assertIsNone(dispatch.get_rate_limiter())
+        self.assertEqual(dispatch.get_rate_limiter(0.5).available(), 1)
+
+
+class CoalesceTestCase(TestCase):
+    def setUp(self):
+        self.first = models.Notification.objects.create(
+            slug='a-slug', enabled=True)
+        self.second = models.Notification.objects.create(
+            slug='another-slug', enabled=True)
+        self.now = datetime.datetime.utcnow()
+
+    def create(
+            self, notification, fingerprint='device', collapse_key='score',
+            **kwargs):
+        return models.NotificationInstance.objects.create(
+            notification=notification, tokens='["token"]', data='{}',
+            provider=pypn.DUMMY,
+            scheduled_at=self.now, fingerprint=fingerprint,
+            collapse_key=collapse_key, **kwargs)
+
+    def test_keep_newest(self):
+        older = self.create(self.first)
+        old = self.create(self.second)
+        newest = self.create(self.first)
+        other_device = self.create(self.first, fingerprint='other')
+        other_key = self.create(self.first, collapse_key='news')
+        no_key = self.create(self.first, collapse_key='')
+        sent = self.create(self.first, sent_at=self.now)
+        for notification in (self.first, self.second):
+            models.NotificationStat.objects.create(
+                notification=notification, provider=pypn.DUMMY,
+                day=self.now.date())
+
+        # Pending instances, then the older ones are locked, canceled
+        # and counted in the stats of each notification
+        with self.assertNumQueries(5):
+            result = dispatch.coalesce([older, old, newest])
+
+        self.assertEqual(result, [newest])
+        canceled = models.NotificationInstance.objects.filter(canceled=True)
+        self.assertEqual(set(canceled), {older, old})
+        self.assertEqual(
+            set(canceled.values_list('result', flat=True)), {'collapsed'})
+        for instance in (newest, other_device, other_key, no_key, sent):
+            self.assertIn(
+                instance,
+                models.NotificationInstance.objects.filter(canceled=False))
+
+    def test_without_collapse_key(self):
+        instances = [
+            self.create(self.first, collapse_key='') for i in range(2)]
+
+        with self.assertNumQueries(0):
+            self.assertEqual(dispatch.coalesce(instances), instances)
+
+    @mock.patch('pypn.Notification.send', side_effect=lambda *args: response())
+    def test_dispatch(self, mock_send):
+        for i in range(5):
+            self.create(self.first if i % 2 else self.second)
+
+        self.assertEqual(dispatch.dispatch_due(), 1)
+        self.assertEqual(mock_send.call_count, 1)
+
+
+class ScheduleCollapseKeyTestCase(TestCase):
+    @mock.patch('djpush.models.NotificationInstance.send')
+    def test_copied(self, mock_send):
+        models.Notification.objects.create(
+            slug='a-slug', enabled=True, gcm_option_collapse_key='score')
+
+        instance = models.schedule_notification(pytz.utc, 'a-slug', ['token'])
+
+        self.assertEqual(instance.collapse_key, 'score')
@@ -0,0 +1,153 @@
+import datetime
+import threading
+import time
+from unittest import mock
+
+from django.core.exceptions import ImproperlyConfigured
+from django.test import TestCase, TransactionTestCase, override_settings
+import pypn
+import pytz
+
+from . import dispatch, executors, models
+from .test_helpers import response
+
+
+@mock.patch('pypn.Notification.send', side_effect=lambda *args: response())
+class DeliverTestCase(TransactionTestCase):
+    # Outside of a transaction, like executors
+    def setUp(self):
+        self.notification = models.Notification.objects.create(
+            slug='a-slug', enabled=True)
+        scheduled_at = datetime.datetime.utcnow() - datetime.timedelta(
+            minutes=2)
+        self.instance = models.NotificationInstance.objects.create(
+            notification=self.notification, tokens='["token"]', data='{}',
+            provider=pypn.DUMMY, scheduled_at=scheduled_at)
+
+    def test_sync(self, mock_send):
+        executors.SyncExecutor().submit(self.instance, countdown=60)
+        self.assertFalse(mock_send.called)
+
+        executors.SyncExecutor().submit(self.instance, countdown=0)
+        self.assertTrue(mock_send.called)
+
+    @mock.patch('djpush.models.NOTIFICATION_EXPIRES', 60)
+    def test_sync_expired(self, mock_send):
+        executors.SyncExecutor().submit(self.instance, countdown=0)
+
+        self.assertFalse(mock_send.called)
+        self.instance.refresh_from_db()
+        self.assertTrue(self.instance.canceled)
+        self.assertEqual(self.instance.result, 'expired')
+
+    def test_deliver_instance(self, mock_send):
+        executors.deliver_instance(self.instance.pk)
+        executors.deliver_instance(self.instance.pk)
+
+        self.assertEqual(mock_send.call_count, 1)
+
+    def test_deliver_instance_canceled(self, mock_send):
+        models.NotificationInstance.objects.update(canceled=True)
+
+        executors.deliver_instance(self.instance.pk)
+
+        self.assertFalse(mock_send.called)
+
+    @mock.patch('djpush.models.NOTIFICATION_EXPIRES', 60)
+    def test_deliver_instance_expired(self, mock_send):
+        executors.deliver_instance(self.instance.pk)
+
+        self.assertFalse(mock_send.called)
+        self.assertTrue(models.NotificationInstance.objects.get().canceled)
+
+    @mock.patch('djpush.dispatch.NOTIFICATION_EXPIRES', 60)
+    def test_dispatch_expired(self, mock_send):
+        self.assertEqual(dispatch.dispatch_due(), 0)
+        self.assertFalse(mock_send.called)
+        self.assertTrue(models.NotificationInstance.objects.get().canceled)
+
+
+class ThreadExecutorTestCase(TestCase):
+    def test_countdown(self):
+        delivered = []
+        done = threading.Event()
+
+        def deliver(pk):
+            delivered.append((pk, time.monotonic()))
+            if len(delivered) == 2:
+                done.set()
+
+        executor = executors.ThreadExecutor(workers=1)
+        with mock.patch('djpush.executors.deliver_instance', deliver):
+            start = time.monotonic()
+            executor.enqueue(1, countdown=0.2)
+            executor.enqueue(2, countdown=0)
+            self.assertTrue(done.wait(2))
+
+        self.assertEqual([pk for pk, at in delivered], [2, 1])
+        self.assertGreaterEqual(delivered[1][1] - start, 0.2)
+
+
+class QueueExecutorsTestCase(TestCase):
+    def test_celery(self):
+        task = mock.Mock()
+
+        executors.CeleryExecutor(task).enqueue(1, countdown=10, expires=60)
+
+        task.apply_async.assert_called_once_with(
+            args=(1, ), countdown=10, expires=70)
+
+    def test_rq(self):
+        queue = mock.Mock()
+        executor = executors.RQExecutor(queue)
+
+        executor.enqueue(1, countdown=0, expires=60)
+        executor.enqueue(2, countdown=10)
+
+        queue.enqueue.assert_called_once_with(
+            executors.deliver_instance, 1, ttl=60)
+        queue.enqueue_in.assert_called_once_with(
+            datetime.timedelta(seconds=10), executors.deliver_instance, 2,
+            ttl=None)
+
+
+class GetExecutorTestCase(TestCase):
+    def tearDown(self):
+        executors._executor = None
+
+    def test_default(self):
+        executors._executor = None
+        self.assertIsInstance(executors.get_executor(), executors.SyncExecutor)
+
+    @override_settings(DJPUSH_EXECUTOR='djpush.executors.ThreadExecutor')
+    def test_dotted_path(self):
+        executors._executor = None
+        self.assertIsInstance(
+            executors.get_executor(), executors.ThreadExecutor)
+
+    @override_settings(DJPUSH_EXECUTOR='not.an.Executor')
+    def test_invalid(self):
+        executors._executor = None
+        with self.assertRaises(ImproperlyConfigured):
+            executors.get_executor()
+
+
+class ScheduleNotificationTestCase(TestCase):
+    @mock.patch('djpush.models.NotificationInstance.send')
+    def test_countdown(self, mock_send):
+        notification = models.Notification.objects.create(
+            slug='a-slug', enabled=True)
+        scheduler = models.SchedulerMinutesLater.objects.create(minutes=5)
+        models.NotificationScheduler.objects.create(
+            notification=notification, scheduler=scheduler, order=0)
+        executor = mock.Mock()
+
+        with mock.patch(
+                'djpush.executors.get_executor', return_value=executor):
+            instance = models.schedule_notification(
+                pytz.utc, 'a-slug', ['token'])
+
+        self.assertFalse(mock_send.called)
+        executor.submit.assert_called_once_with(instance, countdown=mock.ANY)
+        self.assertAlmostEqual(
+            executor.submit.call_args[1]['countdown'], 300, delta=2)
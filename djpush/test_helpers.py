@@ -0,0 +1,10 @@
+from unittest import mock
+
+
+def response(status_code=200):
+    """A provider response"""
+    response_mock = mock.Mock()
+    response_mock.status_code = status_code
+    response_mock.json.return_value = {'recipients': 1}
+    response_mock.content = 'error'
+    return response_mock
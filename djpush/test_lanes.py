@@ -0,0 +1,163 @@
+import datetime
+import threading
+import time
+from unittest import mock
+
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
+import pypn
+
+from . import dispatch, models
+from .lanes import LaneDispatcher, percentile
+
+
+class Delivered:
+    """Replaces `NotificationInstance.deliver`, keeps the order"""
+    def __init__(self, delay=0):
+        self.delay = delay
+        self.order = []
+        self.lock = threading.Lock()
+
+    @property
+    def deliver(self):
+        def deliver(instance):
+            time.sleep(self.delay)
+            with self.lock:
+                self.order.append(instance.pk)
+            return 'sent'
+        return deliver
+
+
+def instances(priority, pks):
+    return [
+        models.NotificationInstance(pk=pk, priority=priority) for pk in pks]
+
+
+class LaneDispatcherTestCase(SimpleTestCase):
+    def test_weighted_round_robin(self):
+        lanes = LaneDispatcher(weights={'high': 4, 'normal': 1}, reserved={})
+        for lane in lanes.lanes.values():
+            lane.queue.extend(range(100))
+
+        picks = [
+            lanes._next(list(lanes.lanes.values())).name for i in range(10)]
+
+        self.assertEqual(picks.count('high'), 8)
+        self.assertEqual(picks.count('normal'), 2)
+
+    def test_reserved_high(self):
+        delivered = Delivered(delay=0.002)
+        lanes = LaneDispatcher(
+            workers=2, weights={'high': 4, 'normal': 1}, reserved={'high': 1})
+        with mock.patch(
+                'djpush.models.NotificationInstance.deliver',
+                delivered.deliver):
+            lanes.submit(instances(models.PRIORITY_NORMAL, range(1, 201)))
+            lanes.submit(instances(models.PRIORITY_HIGH, [1000]))
+            self.assertTrue(lanes.wait(10))
+            lanes.close()
+
+        self.assertLess(delivered.order.index(1000), 10)
+        stats = lanes.stats()
+        self.assertEqual(stats['high']['sent'], 1)
+        self.assertEqual(stats['normal']['sent'], 200)
+        self.assertEqual(stats['normal']['depth'], 0)
+        self.assertLess(
+            stats['high']['latency_p99'], stats['normal']['latency_p99'])
+
+    def test_collect(self):
+        recorder = mock.Mock()
+        lanes = LaneDispatcher(workers=2)
+        with mock.patch(
+                'djpush.models.NotificationInstance.deliver',
+                Delivered().deliver):
+            lanes.submit(instances(models.PRIORITY_NORMAL, [1, 2]))
+            lanes.wait(10)
+
+        self.assertEqual(lanes.collect(recorder), 2)
+        self.assertEqual(recorder.record.call_count, 2)
+        self.assertEqual(lanes.collect(recorder), 0)
+        lanes.close()
+
+    def test_not_delivered(self):
+        recorder = mock.Mock()
+        lanes = LaneDispatcher(workers=2)
+        # Expired or canceled meanwhile
+        with mock.patch(
+                'djpush.models.NotificationInstance.deliver',
+                return_value=None):
+            lanes.submit(instances(models.PRIORITY_HIGH, [1]))
+            lanes.wait(10)
+
+        self.assertEqual(lanes.collect(recorder), 0)
+        self.assertEqual(lanes.stats()['high']['sent'], 0)
+        lanes.close()
+
+    def test_deliver_error(self):
+        recorder = mock.Mock()
+        lanes = LaneDispatcher(workers=2)
+        with mock.patch(
+                'djpush.models.NotificationInstance.deliver',
+                side_effect=ValueError('boom')):
+            lanes.submit(instances(models.PRIORITY_HIGH, [1]))
+            lanes.wait(10)
+
+        self.assertEqual(lanes.collect(recorder), 1)
+        instance = recorder.record.call_args[0][0]
+        self.assertIsNotNone(instance.sent_at)
+        self.assertIn('boom', instance.result)
+        self.assertTrue(instance.failed)
+        lanes.close()
+
+    def test_percentile(self):
+        self.assertIsNone(percentile([], 0.5))
+        self.assertEqual(percentile(range(101), 0.99), 99)
+
+
+@mock.patch('djpush.models.DELIVERY_CHUNK_SIZE', 2)
+class ResumeTestCase(TransactionTestCase):
+    # The lanes threads save `sent_tokens`
+    def test_deliver_error_after_chunks(self):
+        notification = models.Notification.objects.create(
+            slug='a-slug', enabled=True)
+        instance = models.NotificationInstance.objects.create(
+            notification=notification, tokens='["a", "b", "c"]', data='{}',
+            provider=pypn.DUMMY,
+            scheduled_at=datetime.datetime.utcnow())
+        # Claimed, see `sharding`
+        models.NotificationInstance.objects.update(
+            sent_at=datetime.datetime.utcnow(), claimed_by='worker')
+        instance.claimed_by = 'worker'
+        ok = mock.Mock(status_code=200)
+        recorder = mock.Mock()
+        lanes = LaneDispatcher(workers=2)
+        with mock.patch(
+                'pypn.Notification.send', side_effect=[ok, ConnectionError]):
+            lanes.submit([instance])
+            lanes.wait(10)
+
+        self.assertEqual(lanes.collect(recorder), 0)
+        lanes.close()
+        self.assertFalse(recorder.record.called)
+        instance = models.NotificationInstance.objects.get()
+        self.assertEqual(instance.sent_tokens, 2)
+        self.assertIsNone(instance.sent_at)
+        self.assertEqual(instance.claimed_by, '')
+
+
+class DispatchOrderTestCase(TestCase):
+    def test_high_first(self):
+        notification = models.Notification.objects.create(
+            slug='a-slug', enabled=True)
+        now = datetime.datetime.utcnow()
+        for i in range(3):
+            models.NotificationInstance.objects.create(
+                notification=notification, tokens='["token"]', data='{}',
+                provider=pypn.DUMMY,
+                scheduled_at=now - datetime.timedelta(minutes=10),
+                priority=models.PRIORITY_NORMAL)
+        high = models.NotificationInstance.objects.create(
+            notification=notification, tokens='["token"]', data='{}',
+            provider=pypn.DUMMY,
+            scheduled_at=now, priority=models.PRIORITY_HIGH)
+
+        self.assertEqual(list(dispatch.get_due_instances(limit=1)), [high])
@@ -0,0 +1,46 @@
+from django.test import TestCase
+
+from . import loadtest, models
+
+
+class FakeProviderServerTestCase(TestCase):
+    def test_load_test(self):
+        with loadtest.FakeProviderServer() as server:
+            report = loadtest.run_load_test(
+                server.url, instances=20, workers=4)
+
+        self.assertEqual(report['sent'], 20)
+        self.assertEqual(server.responses[200], 20)
+        self.assertIsNotNone(report['latency_p99'])
+        self.assertGreater(report['dispatch_queries'], 0)
+        self.assertEqual(
+            models.NotificationInstance.objects.filter(
+                sent_at__isnull=True).count(),
+            0)
+
+    def test_errors_and_throttling(self):
+        with loadtest.FakeProviderServer(
+                error_rate=0.5, throttle_rate=0.5) as server:
+            loadtest.run_load_test(server.url, instances=10, workers=2)
+
+        self.assertEqual(server.responses[500] + server.responses[429], 10)
+        for result in models.NotificationInstance.objects.values_list(
+                'result', flat=True):
+            self.assertIn('errors', result)
+
+    def test_invalid_tokens(self):
+        with loadtest.FakeProviderServer(invalid_rate=1) as server:
+            loadtest.run_load_test(
+                server.url, instances=2, tokens=3, style=loadtest.GCM)
+
+        for result in models.NotificationInstance.objects.values_list(
+                'result', flat=True):
+            self.assertIn("'failure': 3", result)
+
+    def test_apns(self):
+        with loadtest.FakeProviderServer() as server:
+            report = loadtest.run_load_test(
+                server.url, instances=2, tokens=3, style=loadtest.APNS)
+
+        self.assertEqual(report['sent'], 2)
+        self.assertEqual(server.responses[200], 6)
@@ -0,0 +1,111 @@
+from concurrent.futures import ThreadPoolExecutor
+import datetime
+import json
+import time
+from unittest import mock, skipIf
+
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
+import pytz
+
+from . import dispatch, models
+
+
+tz = pytz.timezone('Europe/Paris')
+
+# Threads can't share the in-memory SQLite test database
+in_memory_db = (
+    connection.vendor == 'sqlite' and connection.creation.is_in_memory_db(
+        connection.settings_dict['TEST']['NAME'] or ':memory:'))
+
+
+class LockNotificationTestCase(TestCase):
+    def test_lock_row(self):
+        notification = models.Notification.objects.create(
+            slug='a-slug', enabled=True)
+
+        models.lock_notification(notification, 'fingerprint')
+        models.lock_notification(notification, 'fingerprint')
+        models.lock_notification(notification, 'other')
+
+        if connection.vendor != 'postgresql':
+            self.assertEqual(models.NotificationLock.objects.count(), 2)
+
+    def test_prune_locks(self):
+        notification = models.Notification.objects.create(
+            slug='a-slug', enabled=True)
+        models.lock_notification(notification, 'fingerprint')
+        now = datetime.datetime.utcnow()
+        models.NotificationLock.objects.create(
+            notification=notification, fingerprint='old',
+            locked_at=now - datetime.timedelta(hours=2))
+
+        self.assertEqual(models.prune_locks(now), 1)
+
+        fingerprints = models.NotificationLock.objects.values_list(
+            'fingerprint', flat=True)
+        if connection.vendor != 'postgresql':
+            self.assertEqual(list(fingerprints), ['fingerprint'])
+
+
+@skipIf(
+    in_memory_db, "Requires a database that accepts concurrent connections")
+class ScheduleNotificationConcurrencyTestCase(TransactionTestCase):
+    calls = 200
+    workers = 8
+    # Calls per second, far below what SQLite does on a slow machine
+    min_throughput = 10
+
+    def schedule(self, tokens):
+        try:
+            return models.schedule_notification(tz, 'a-slug', tokens)
+        finally:
+            connection.close()
+
+    def run_concurrently(self, tokens_list):
+        with mock.patch('pypn.Notification.send') as mock_send:
+            mock_send.return_value.status_code = 200
+            mock_send.return_value.json.return_value = {}
+            start = time.monotonic()
+            with ThreadPoolExecutor(self.workers) as pool:
+                list(pool.map(self.schedule, tokens_list))
+            elapsed = time.monotonic() - start
+        self.assertGreater(len(tokens_list) / elapsed, self.min_throughput)
+        return mock_send
+
+    def test_same_tokens_scheduled(self):
+        # Each call cancels the previous one, only one is left
+        notification = models.Notification.objects.create(
+            slug='a-slug', enabled=True)
+        scheduler = models.SchedulerMinutesLater.objects.create(minutes=5)
+        models.NotificationScheduler.objects.create(
+            notification=notification, scheduler=scheduler, order=0)
+
+        with mock.patch('djpush.models.NotificationInstance.send'):
+            self.run_concurrently([['token', 'token1']] * self.calls)
+        with mock.patch('pypn.Notification.send') as mock_send:
+            mock_send.return_value.status_code = 200
+            later = datetime.datetime.utcnow() + datetime.timedelta(minutes=10)
+            dispatch.dispatch_due(now=later)
+
+        self.assertEqual(
+            models.NotificationInstance.objects.count(), self.calls)
+        self.assertEqual(
+            models.NotificationInstance.objects.filter(canceled=False).count(),
+            1)
+        self.assertEqual(mock_send.call_count, 1)
+
+    def test_different_tokens(self):
+        models.Notification.objects.create(slug='a-slug', enabled=True)
+
+        mock_send = self.run_concurrently(
+            [['token%d' % i] for i in range(self.calls)])
+
+        self.assertEqual(mock_send.call_count, self.calls)
+        # Each token sent once
+        sent = [call[0][0][0] for call in mock_send.call_args_list]
+        self.assertEqual(len(set(sent)), self.calls)
+        tokens = models.NotificationInstance.objects.values_list(
+            'tokens', flat=True)
+        self.assertEqual(
+            len(set(json.loads(t)[0] for t in tokens)), self.calls)
@@ -7,6 +7,7 @@ import pypn
 import pytz
 
 from . import models
+from .test_helpers import response
 
 
 tz = pytz.timezone('Europe/Paris')
@@ -18,7 +19,7 @@ class SendTestCase(TestCase):
         tokens = '["token", "token1"]'
         data = '{}'
         notification_instance = models.NotificationInstance.objects.create(notification=notification, tokens=tokens, data=data, provider=pypn.DUMMY)
-        with mock.patch('djpush.models.pypn.Notification.send') as mock_send:
+        with mock.patch('pypn.Notification.send') as mock_send:
             response_mock = mock.Mock()
             response_mock.status_code = 200
             response_mock.json.return_value = {
@@ -32,6 +33,76 @@ class SendTestCase(TestCase):
             mock_send.assert_called_once_with(json.loads(tokens), json.loads(data))
 
 
+@mock.patch('djpush.models.DELIVERY_CHUNK_SIZE', 2)
+class ChunkedSendTestCase(TestCase):
+    def setUp(self):
+        notification = models.Notification.objects.create(slug='a-slug', enabled=True)
+        self.tokens = ['token{}'.format(i) for i in range(5)]
+        self.instance = models.NotificationInstance.objects.create(
+            notification=notification, tokens=json.dumps(self.tokens),
+            data='{}', provider=pypn.DUMMY)
+
+    def test_chunks(self):
+        with mock.patch(
+                'pypn.Notification.send',
+                side_effect=lambda *args: response()) as mock_send:
+            self.instance.send()
+
+        self.assertEqual([call[0][0] for call in mock_send.call_args_list],
+                         [self.tokens[:2], self.tokens[2:4], self.tokens[4:]])
+        instance = models.NotificationInstance.objects.get()
+        self.assertEqual(instance.sent_tokens, 5)
+        self.assertIsNotNone(instance.sent_at)
+
+    def test_resume(self):
+        calls = []
+
+        def send(tokens, data):
+            calls.append(tokens)
+            if len(calls) == 2:
+                raise ConnectionError
+            return response()
+
+        with mock.patch('pypn.Notification.send', side_effect=send):
+            with self.assertRaises(ConnectionError):
+                self.instance.send()
+            self.assertEqual(
+                models.NotificationInstance.objects.get().sent_tokens, 2)
+
+            models.NotificationInstance.objects.get().send()
+
+        self.assertEqual(
+            calls,
+            [
+                self.tokens[:2], self.tokens[2:4], self.tokens[2:4],
+                self.tokens[4:]])
+        self.assertIsNotNone(models.NotificationInstance.objects.get().sent_at)
+
+    def test_throttled_chunk(self):
+        responses = [response(), response(), response()]
+        responses[1].status_code = 429
+
+        with mock.patch(
+                'pypn.Notification.send', side_effect=responses) as mock_send:
+            self.instance.send()
+
+        self.assertEqual(mock_send.call_count, 2)
+        instance = models.NotificationInstance.objects.get()
+        self.assertEqual(instance.sent_tokens, 2)
+        self.assertTrue(instance.failed)
+
+    def test_single_chunk(self):
+        self.instance.tokens = json.dumps(self.tokens[:2])
+
+        with mock.patch(
+                'pypn.Notification.send',
+                side_effect=lambda *args: response()):
+            with self.assertNumQueries(0):
+                self.instance.deliver()
+
+        self.assertEqual(self.instance.sent_tokens, 0)
+
+
 class NotificationTestCase(TestCase):
     def test_as_dict(self):
         context = {'username': 'yahoo', 'emoji': '😎'}
@@ -91,9 +162,10 @@ class SchedulerTestCase(TestCase):
         mock_scheduler.get_scheduler_args = mock_get_args
         mock_get_child = mock.Mock()
         mock_get_child.return_value = mock_scheduler
-        models.Scheduler.get_child_scheduler = mock_get_child
 
-        models.Scheduler().get_schedule(now).replace(microsecond=0)
+        with mock.patch.object(
+                models.Scheduler, 'get_child_scheduler', mock_get_child):
+            models.Scheduler().get_schedule(now).replace(microsecond=0)
 
         mock_get_child.assert_called_once_with()
         mock_get_args.assert_called_once_with()
@@ -117,7 +189,7 @@ class ScheduleNotificationTestCase(TestCase):
             result = models.schedule_notification(timezone, slug, tokens, context)
 
         self.assertIsNotNone(result)
-        mock_as_dict.assert_called_once_with(context)
+        mock_as_dict.assert_called_once_with(context, languages=None)
 
     def test_scheduler_discard(self):
         slug = 'a-slug'
@@ -132,3 +204,237 @@ class ScheduleNotificationTestCase(TestCase):
             result = models.schedule_notification(timezone, slug, tokens)
 
         self.assertIsNone(result)
+
+
+class ScheduleRampTestCase(TestCase):
+    def setUp(self):
+        # A range starting after now
+        hour = datetime.datetime.utcnow().hour
+        self.start_hour = hour + 2 if hour <= 20 else 1
+        scheduler = models.SchedulerInTimeRange.objects.create(
+            start_hour=self.start_hour, end_hour=self.start_hour + 1,
+            ramp_minutes=60)
+        notification = models.Notification.objects.create(slug='a-slug', enabled=True)
+        models.NotificationScheduler.objects.create(notification=notification, scheduler=scheduler, order=0)
+
+    @mock.patch('djpush.models.NotificationInstance.send')
+    def test_spread(self, mock_send):
+        instances = [
+            models.schedule_notification(
+                pytz.utc, 'a-slug', ['token{}'.format(i)])
+            for i in range(10)]
+
+        schedules = {instance.scheduled_at for instance in instances}
+        self.assertGreater(len(schedules), 1)
+        self.assertEqual(
+            {schedule.hour for schedule in schedules}, {self.start_hour})
+
+    @mock.patch('djpush.models.NotificationInstance.send')
+    def test_same_tokens_deduplicated(self, mock_send):
+        first = models.schedule_notification(pytz.utc, 'a-slug', ['token'])
+        second = models.schedule_notification(pytz.utc, 'a-slug', ['token'])
+
+        self.assertEqual(first.scheduled_at, second.scheduled_at)
+        self.assertTrue(
+            models.NotificationInstance.objects.get(pk=first.pk).canceled)
+        self.assertFalse(
+            models.NotificationInstance.objects.get(pk=second.pk).canceled)
+
+
+class OptOutTestCase(TestCase):
+    def setUp(self):
+        self.category = models.NotificationCategory.objects.create(
+            name='news', opt_out=True)
+        self.notification = models.Notification.objects.create(
+            slug='a-slug', enabled=True, category=self.category)
+
+    def test_opt_out_opt_in(self):
+        models.opt_out(self.category, ['token', 'token1'])
+        models.opt_out(self.category, ['token'])
+
+        self.assertEqual(
+            models.get_opted_out(self.category, ['token', 'token1', 'token2']),
+            {'token', 'token1'})
+
+        models.opt_in(self.category, ['token'])
+
+        self.assertEqual(
+            models.get_opted_out(self.category, ['token', 'token1']),
+            {'token1'})
+
+    @mock.patch('djpush.models.NotificationInstance.send')
+    def test_schedule_excludes_opted_out(self, mock_send):
+        models.opt_out(self.category, ['token1'])
+
+        models.schedule_notification(
+            tz, 'a-slug', ['token', 'token1', 'token2'])
+
+        instance = models.NotificationInstance.objects.get()
+        self.assertEqual(json.loads(instance.tokens), ['token', 'token2'])
+
+    @mock.patch('djpush.models.NotificationInstance.send')
+    def test_schedule_generator(self, mock_send):
+        models.opt_out(self.category, ['token1'])
+
+        models.schedule_notification(
+            tz, 'a-slug', (token for token in ['token', 'token1']))
+        models.opt_in(self.category, ['token1'])
+        models.schedule_notification(
+            tz, 'a-slug', (token for token in ['token2']))
+
+        tokens = models.NotificationInstance.objects.order_by(
+            'pk').values_list('tokens', flat=True)
+        self.assertEqual(list(tokens), ['["token"]', '["token2"]'])
+
+    @mock.patch('djpush.models.NotificationInstance.send')
+    def test_schedule_all_opted_out(self, mock_send):
+        models.opt_out(self.category, ['token'])
+
+        result = models.schedule_notification(tz, 'a-slug', ['token'])
+
+        self.assertIsNone(result)
+        self.assertFalse(models.NotificationInstance.objects.exists())
+
+    @mock.patch('djpush.models.NotificationInstance.send')
+    def test_category_without_opt_out(self, mock_send):
+        self.category.opt_out = False
+        self.category.save()
+        models.opt_out(self.category, ['token1'])
+
+        models.schedule_notification(tz, 'a-slug', ['token', 'token1'])
+
+        instance = models.NotificationInstance.objects.get()
+        self.assertEqual(json.loads(instance.tokens), ['token', 'token1'])
+
+
+class RenderCacheTestCase(TestCase):
+    def setUp(self):
+        models.render_cache.clear()
+        self.notification = models.Notification.objects.create(
+            slug='a-slug', title='hello {{ username }}!', body='body')
+
+    def test_languages(self):
+        notification = models.Notification(title='hello', body='body')
+        notification.title_es = 'hola'
+        notification.title_fr = 'salut'
+
+        result = notification.as_dict(languages=['es'])
+
+        self.assertEqual(result['title'], {'en': 'hello', 'es': 'hola'})
+
+    def test_cache_hit(self):
+        first = self.notification.as_dict({'username': 'yahoo', 'other': 1})
+        first['title']['en'] = 'modified by the caller'
+        second = self.notification.as_dict({'other': 1, 'username': 'yahoo'})
+
+        self.assertEqual(second['title']['en'], 'hello yahoo!')
+        self.assertEqual(models.render_cache.stats()['hits'], 1)
+        self.assertEqual(models.render_cache.stats()['misses'], 1)
+
+    def test_cache_miss(self):
+        self.notification.as_dict({'username': 'yahoo'})
+        self.notification.as_dict({'username': 'google'})
+        self.notification.as_dict({'username': 'yahoo'}, languages=['en'])
+
+        self.assertEqual(models.render_cache.stats()['hits'], 0)
+        self.assertEqual(len(models.render_cache), 3)
+
+    def test_save_invalidates(self):
+        self.notification.as_dict({'username': 'yahoo'})
+        self.notification.title = 'bye {{ username }}!'
+        self.notification.save()
+
+        result = self.notification.as_dict({'username': 'yahoo'})
+
+        self.assertEqual(result['title']['en'], 'bye yahoo!')
+
+    def test_objects_not_cached(self):
+        class Person:
+            def __init__(self, email):
+                self.email = email
+
+            def __str__(self):
+                return 'bob'
+
+        self.notification.title = '{{ person.email }}'
+        self.notification.save()
+
+        first = self.notification.as_dict({'person': Person('a@example.com')})
+        second = self.notification.as_dict({'person': Person('b@example.com')})
+
+        self.assertEqual(first['title']['en'], 'a@example.com')
+        self.assertEqual(second['title']['en'], 'b@example.com')
+        self.assertEqual(len(models.render_cache), 0)
+
+    def test_concurrent_saves(self):
+        first = models.Notification.objects.get()
+        second = models.Notification.objects.get()
+
+        first.save()
+        second.save(update_fields=['title'])
+
+        self.assertEqual((first.version, second.version), (2, 3))
+        self.assertEqual(models.Notification.objects.get().version, 3)
+
+    def test_max_size(self):
+        max_size = models.render_cache.max_size
+        models.render_cache.max_size = 2
+        try:
+            for username in ('a', 'b', 'c'):
+                self.notification.as_dict({'username': username})
+        finally:
+            models.render_cache.max_size = max_size
+
+        self.assertEqual(len(models.render_cache), 2)
+
+
+class PayloadTestCase(TestCase):
+    def setUp(self):
+        models.payload_cache.clear()
+        self.notification = models.Notification.objects.create(
+            slug='a-slug', enabled=True, title='hello {{ username }}!',
+            body='body')
+
+    def test_save_payloads(self):
+        digests = models.save_payloads(['{"a": 1}', '{"b": 2}', '{"a": 1}'])
+        again = models.save_payloads(['{"b": 2}', '{"c": 3}'])
+
+        self.assertEqual(digests[0], digests[2])
+        self.assertEqual(again[0], digests[1])
+        self.assertEqual(models.Payload.objects.count(), 3)
+        self.assertEqual(
+            models.Payload.objects.get(pk=digests[0]).data, '{"a": 1}')
+
+    @mock.patch('djpush.models.NotificationInstance.send')
+    def test_schedule_shares_payload(self, mock_send):
+        models.schedule_notification(
+            tz, 'a-slug', ['token'], {'username': 'yahoo'})
+        models.schedule_notification(
+            tz, 'a-slug', ['token1'], {'username': 'yahoo'})
+        models.schedule_notification(
+            tz, 'a-slug', ['token2'], {'username': 'google'})
+
+        instances = models.NotificationInstance.objects.order_by('pk')
+        self.assertEqual(models.Payload.objects.count(), 2)
+        self.assertEqual(instances[0].payload_id, instances[1].payload_id)
+        self.assertEqual(instances[0].data, '')
+        self.assertEqual(
+            json.loads(instances[2].get_data())['title']['en'],
+            'hello google!')
+
+    def test_get_data_cached(self):
+        digest, = models.save_payloads(['{"a": 1}'])
+        models.payload_cache.clear()
+        instance = models.NotificationInstance(payload_id=digest)
+
+        with self.assertNumQueries(1):
+            instance.get_data()
+            instance.get_data()
+
+        self.assertEqual(instance.get_data(), '{"a": 1}')
+
+    def test_get_data_inline(self):
+        instance = models.NotificationInstance(data='{"b": 2}')
+
+        with self.assertNumQueries(0):
+            self.assertEqual(instance.get_data(), '{"b": 2}')
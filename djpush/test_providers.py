@@ -0,0 +1,114 @@
+import json
+import os
+import subprocess
+import sys
+from unittest import mock
+
+from django.core.exceptions import ImproperlyConfigured
+from django.test import SimpleTestCase, override_settings
+
+from . import providers
+
+
+class Provider:
+    def send(self, tokens, data):
+        return tokens, data
+
+
+class ProvidersTestCase(SimpleTestCase):
+    def tearDown(self):
+        providers._registry.pop('test', None)
+        providers._providers.clear()
+
+    def test_register(self):
+        providers.register('test', Provider)
+
+        provider = providers.get_provider('test')
+
+        self.assertIsInstance(provider, Provider)
+        self.assertIs(providers.get_provider('test'), provider)
+
+    @override_settings(
+        DJPUSH_PROVIDERS={'test': 'djpush.test_providers.Provider'})
+    def test_setting(self):
+        self.assertIsInstance(providers.get_provider('test'), Provider)
+
+    @override_settings(
+        DJPUSH_PROVIDERS={'test': 'djpush.not_a_module.Provider'})
+    def test_setting_invalid(self):
+        with self.assertRaises(ImproperlyConfigured):
+            providers.get_provider('test')
+
+    def test_entry_point(self):
+        entry_point = mock.Mock()
+        entry_point.load.return_value = Provider
+        with mock.patch(
+                'pkg_resources.iter_entry_points',
+                return_value=[entry_point]) as mock_iter:
+            provider = providers.get_provider('test')
+
+        mock_iter.assert_called_once_with('djpush.providers', 'test')
+        self.assertIsInstance(provider, Provider)
+
+    def test_pypn(self):
+        provider = providers.get_provider('dummy')
+
+        self.assertIsInstance(provider, providers.PypnProvider)
+        self.assertEqual(
+            provider.send(['token'], {'body': 'hello'}),
+            (['token'], {'body': 'hello'}))
+
+    @override_settings(DJPUSH_DEFAULT_PROVIDER=None)
+    def test_default_provider_required(self):
+        with self.assertRaises(ImproperlyConfigured):
+            providers.get_default_provider()
+
+
+SETUP_SCRIPT = '''
+import json, sys, time
+import django
+from django.conf import settings
+settings.configure(
+    INSTALLED_APPS=%r,
+    DATABASES={'default': {
+        'ENGINE': 'django.db.backends.sqlite3', 'NAME': ':memory:'}},
+    SECRET_KEY='x',
+    DJPUSH_DEFAULT_PROVIDER='dummy',
+)
+start = time.perf_counter()
+django.setup()
+print(json.dumps({
+    'seconds': time.perf_counter() - start,
+    'modules': sorted(sys.modules),
+}))
+'''
+
+
+class ImportTimeTestCase(SimpleTestCase):
+    # Seconds `import djpush.models` may add to `django.setup()`
+    budget = 0.5
+    # Only imported to send notifications
+    lazy_modules = ('pypn', 'requests', 'apns2', 'gcm', 'yaosac')
+
+    def setup_django(self, installed_apps):
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        pythonpath = [root]
+        if os.environ.get('PYTHONPATH'):
+            pythonpath.append(os.environ['PYTHONPATH'])
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(pythonpath))
+        runs = []
+        for i in range(3):
+            output = subprocess.check_output(
+                [sys.executable, '-c', SETUP_SCRIPT % (installed_apps, )],
+                env=env, cwd=root)
+            runs.append(json.loads(output.decode()))
+        return min(run['seconds'] for run in runs), set(runs[0]['modules'])
+
+    def test_import_djpush_models(self):
+        baseline, baseline_modules = self.setup_django([])
+        seconds, modules = self.setup_django(['djpush'])
+
+        self.assertIn('djpush.models', modules)
+        for name in self.lazy_modules:
+            self.assertNotIn(name, modules)
+        self.assertLess(seconds - baseline, self.budget)
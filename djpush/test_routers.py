@@ -0,0 +1,106 @@
+from unittest import mock
+
+from django.db import router
+from django.test import TestCase, override_settings
+import pytz
+
+from . import models
+from .routers import ReplicaRouter
+
+
+replica_router = ReplicaRouter('replica', pin_seconds=5)
+
+
+@override_settings(DATABASE_ROUTERS=[replica_router])
+class ReplicaRouterTestCase(TestCase):
+    multi_db = True
+
+    def setUp(self):
+        replica_router._local.pinned_until = None
+
+    def test_routing(self):
+        self.assertEqual(router.db_for_read(models.Notification), 'replica')
+        self.assertEqual(
+            router.db_for_read(models.SchedulerInTimeRange), 'replica')
+        self.assertEqual(
+            router.db_for_read(models.NotificationInstance), 'default')
+        self.assertEqual(
+            router.db_for_read(models.NotificationOptOut), 'default')
+        self.assertEqual(router.db_for_read(models.Payload), 'default')
+        self.assertEqual(
+            router.db_for_write(models.NotificationInstance), 'default')
+
+    def test_pinned_after_write(self):
+        now = [0]
+        replica_router.clock, clock = lambda: now[0], replica_router.clock
+        try:
+            models.Notification.objects.create(slug='a-slug', enabled=True)
+            self.assertEqual(
+                router.db_for_read(models.Notification), 'default')
+            now[0] = 5
+            self.assertEqual(
+                router.db_for_read(models.Notification), 'replica')
+        finally:
+            replica_router.clock = clock
+
+    def test_save_read_from_replica(self):
+        models.Notification.objects.using('replica').create(
+            slug='a-slug', enabled=True)
+        notification = models.Notification.objects.get()
+
+        notification.save()
+
+        self.assertEqual(
+            models.Notification.objects.using('default').get().pk,
+            notification.pk)
+
+    @mock.patch('djpush.models.NotificationInstance.send')
+    def test_schedule(self, mock_send):
+        notification = models.Notification.objects.using('replica').create(
+            slug='a-slug', enabled=True)
+        scheduler = models.SchedulerMinutesLater.objects.using(
+            'replica').create(minutes=5)
+        models.NotificationScheduler.objects.using('replica').create(
+            notification=notification, scheduler=scheduler, order=0)
+        replica_router._local.pinned_until = None
+
+        instance = models.schedule_notification(pytz.utc, 'a-slug', ['token'])
+
+        self.assertIsNotNone(instance.scheduled_at)
+        self.assertEqual(
+            models.NotificationInstance.objects.using('default').get().pk,
+            instance.pk)
+        self.assertFalse(
+            models.NotificationInstance.objects.using('replica').exists())
+        self.assertFalse(models.Payload.objects.using('replica').exists())
+
+    @mock.patch('djpush.models.NotificationInstance.send')
+    def test_schedule_lagging_replica(self, mock_send):
+        models.Notification.objects.using('default').create(
+            slug='a-slug', enabled=True)
+        replica_router._local.pinned_until = None
+
+        instance = models.schedule_notification(pytz.utc, 'a-slug', ['token'])
+
+        self.assertIsNotNone(instance)
+
+    def test_schedule_missing(self):
+        self.assertIsNone(
+            models.schedule_notification(pytz.utc, 'a-slug', ['token']))
+        # Not pinned by the miss
+        self.assertEqual(router.db_for_read(models.Notification), 'replica')
+
+
+class UsingTestCase(TestCase):
+    multi_db = True
+
+    @mock.patch('djpush.models.NotificationInstance.send')
+    def test_schedule_using(self, mock_send):
+        models.Notification.objects.using('replica').create(
+            slug='a-slug', enabled=True)
+
+        self.assertIsNone(
+            models.schedule_notification(pytz.utc, 'a-slug', ['token']))
+        self.assertIsNotNone(
+            models.schedule_notification(
+                pytz.utc, 'a-slug', ['token'], using='replica'))
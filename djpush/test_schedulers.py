@@ -87,3 +87,32 @@ class SchedulerInTimeRangeTestCase(TestCase):
         result = schedulers.SchedulerInTimeRange(*scheduler_args_local)(datetime(*fake_now_args))
 
         self.assertEqual(result, None)
+
+    def test_ramp(self):
+        global fake_now_args
+        fake_now_args = (2016, 9, 25, 4, 0, 0)
+        scheduler = schedulers.SchedulerInTimeRange(*scheduler_args, ramp=600)
+
+        self.assertEqual(
+            scheduler(datetime(*fake_now_args)),
+            datetime(2016, 9, 25, 8, 0, 0))
+        self.assertEqual(
+            scheduler(datetime(*fake_now_args), 0.5),
+            datetime(2016, 9, 25, 8, 5, 0))
+
+    def test_ramp_in_range(self):
+        global fake_now_args
+        fake_now_args = (2016, 9, 25, 14, 0, 0)
+        scheduler = schedulers.SchedulerInTimeRange(*scheduler_args, ramp=600)
+
+        self.assertEqual(
+            scheduler(datetime(*fake_now_args), 0.5), datetime(*fake_now_args))
+
+    def test_ramp_longer_than_range(self):
+        global fake_now_args
+        fake_now_args = (2016, 9, 25, 4, 0, 0)
+        scheduler = schedulers.SchedulerInTimeRange(8, 9, False, ramp=7200)
+
+        result = scheduler(datetime(*fake_now_args), 0.9999)
+
+        self.assertEqual(result.hour, 8)
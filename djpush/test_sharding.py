@@ -0,0 +1,170 @@
+import datetime
+import json
+from unittest import mock
+
+from django.db.models import F
+from django.test import TestCase
+import pypn
+
+from . import dispatch, models
+from .sharding import Coordinator
+from .test_helpers import response
+
+
+class CoordinatorTestCase(TestCase):
+    def setUp(self):
+        self.now = datetime.datetime(2017, 3, 8, 14, 42)
+        self.first = Coordinator('first', partitions=8, lease_duration=30)
+        self.second = Coordinator('second', partitions=8, lease_duration=30)
+
+    def test_single_worker(self):
+        self.assertEqual(self.first.heartbeat(self.now), set(range(8)))
+
+    def test_rebalance_on_join(self):
+        self.first.heartbeat(self.now)
+        self.second.heartbeat(self.now)
+        self.first.heartbeat(self.now)
+        self.second.heartbeat(self.now)
+
+        self.assertEqual(len(self.first.owned), 4)
+        self.assertEqual(len(self.second.owned), 4)
+        self.assertFalse(self.first.owned & self.second.owned)
+
+    def test_rebalance_on_death(self):
+        self.first.heartbeat(self.now)
+        self.second.heartbeat(self.now)
+        self.first.heartbeat(self.now)
+        self.second.heartbeat(self.now)
+
+        # `second` stops sending heartbeats, its leases expire
+        later = self.now + datetime.timedelta(seconds=31)
+        self.assertEqual(self.first.heartbeat(later), set(range(8)))
+
+    def test_unregister(self):
+        self.first.heartbeat(self.now)
+        self.second.heartbeat(self.now)
+        self.first.heartbeat(self.now)
+        self.second.heartbeat(self.now)
+
+        self.second.unregister()
+
+        self.assertEqual(self.first.heartbeat(self.now), set(range(8)))
+
+
+@mock.patch('pypn.Notification.send', side_effect=lambda *args: response())
+class ShardedDispatchTestCase(TestCase):
+    def setUp(self):
+        notification = models.Notification.objects.create(
+            slug='a-slug', enabled=True)
+        now = datetime.datetime.utcnow()
+        for i in range(20):
+            models.NotificationInstance.objects.create(
+                notification=notification, tokens='["token"]', data='{}',
+                provider=pypn.DUMMY,
+                scheduled_at=now)
+        self.first = Coordinator('first', partitions=4)
+        self.second = Coordinator('second', partitions=4)
+        for coordinator in (self.first, self.second, self.first, self.second):
+            coordinator.heartbeat()
+
+    def test_partitions(self, mock_send):
+        instances = models.NotificationInstance.objects.all()
+        first = set(self.first.filter(instances).values_list('pk', flat=True))
+        second = set(
+            self.second.filter(instances).values_list('pk', flat=True))
+
+        self.assertFalse(first & second)
+        self.assertEqual(
+            first | second, set(instances.values_list('pk', flat=True)))
+
+    def test_partitions_from_more_partitions(self, mock_send):
+        # Created when there were more partitions
+        models.NotificationInstance.objects.update(
+            partition=F('partition') + models.PARTITIONS)
+        instances = models.NotificationInstance.objects.all()
+        first = set(self.first.filter(instances).values_list('pk', flat=True))
+        second = set(
+            self.second.filter(instances).values_list('pk', flat=True))
+
+        self.assertFalse(first & second)
+        self.assertEqual(
+            first | second, set(instances.values_list('pk', flat=True)))
+
+    def test_claim(self, mock_send):
+        instances = list(models.NotificationInstance.objects.all())
+
+        self.assertEqual(len(self.first.claim(instances)), 20)
+        self.assertEqual(self.second.claim(instances), [])
+
+    def test_dispatch(self, mock_send):
+        sent = dispatch.dispatch_due(coordinator=self.first)
+        sent += dispatch.dispatch_due(coordinator=self.second)
+
+        self.assertEqual(sent, 20)
+        self.assertEqual(mock_send.call_count, 20)
+        self.assertEqual(
+            models.NotificationInstance.objects.filter(result='').count(), 0)
+
+
+@mock.patch('djpush.models.DELIVERY_CHUNK_SIZE', 2)
+@mock.patch('pypn.Notification.send', side_effect=lambda *args: response())
+class ResumeTestCase(TestCase):
+    def setUp(self):
+        notification = models.Notification.objects.create(
+            slug='a-slug', enabled=True)
+        self.tokens = ['token{}'.format(i) for i in range(5)]
+        now = datetime.datetime.utcnow()
+        # Claimed by a worker that died after the first chunk
+        self.chunked = models.NotificationInstance.objects.create(
+            notification=notification, tokens=json.dumps(self.tokens),
+            data='{}', provider=pypn.DUMMY, scheduled_at=now, sent_at=now,
+            claimed_by='dead', sent_tokens=2)
+        self.single = models.NotificationInstance.objects.create(
+            notification=notification, tokens='["token"]', data='{}',
+            provider=pypn.DUMMY, scheduled_at=now, sent_at=now,
+            claimed_by='dead')
+        self.coordinator = Coordinator('alive', partitions=4)
+        self.coordinator.heartbeat()
+
+    def test_resume(self, mock_send):
+        self.assertEqual(self.coordinator.resume(), [self.chunked])
+        self.assertEqual(self.coordinator.resume(), [])
+
+    def test_recent_chunk_not_resumed(self, mock_send):
+        # The worker looks dead but is still sending
+        models.NotificationInstance.objects.filter(
+            pk=self.chunked.pk
+        ).update(claimed_at=datetime.datetime.utcnow())
+
+        self.assertEqual(self.coordinator.resume(), [])
+
+    def test_resumed_delivery_stops(self, mock_send):
+        # Still sending after the worker looked dead, it claimed the
+        # instance without setting `sent_at` in memory
+        self.chunked.sent_at = None
+        self.coordinator.resume()
+
+        self.assertIsNone(self.chunked.deliver())
+        self.assertEqual(mock_send.call_count, 1)
+        instance = models.NotificationInstance.objects.get(pk=self.chunked.pk)
+        self.assertEqual(instance.claimed_by, 'alive')
+        self.assertEqual(instance.sent_tokens, 2)
+
+    def test_live_worker_not_resumed(self, mock_send):
+        Coordinator('dead', partitions=4).heartbeat()
+
+        self.assertEqual(self.coordinator.resume(), [])
+
+    def test_dispatch(self, mock_send):
+        self.assertEqual(
+            dispatch.dispatch_due(coordinator=self.coordinator), 1)
+
+        self.assertEqual([call[0][0] for call in mock_send.call_args_list],
+                         [self.tokens[2:4], self.tokens[4:]])
+        instance = models.NotificationInstance.objects.get(pk=self.chunked.pk)
+        self.assertEqual(instance.claimed_by, 'alive')
+        self.assertEqual(instance.sent_tokens, 5)
+        self.assertNotEqual(instance.result, '')
+        self.assertEqual(
+            models.NotificationInstance.objects.get(pk=self.single.pk).result,
+            '')
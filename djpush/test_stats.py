@@ -0,0 +1,138 @@
+import datetime
+from unittest import mock
+
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
+import pypn
+import pytz
+
+from . import dispatch, models, stats
+from .test_helpers import response
+
+
+class StatsTestCase(TestCase):
+    def setUp(self):
+        self.category = models.NotificationCategory.objects.create(name='news')
+        self.notification = models.Notification.objects.create(
+            slug='a-slug', enabled=True, category=self.category)
+        self.day = datetime.datetime.utcnow().date()
+
+    def counters(self):
+        row = stats.get_stats(group_by=('notification', ))[0]
+        return {name: row[name] for name in models.STAT_COUNTERS}
+
+    @mock.patch('pypn.Notification.send')
+    def test_incremental(self, mock_send):
+        mock_send.side_effect = [response(), response(500)]
+        scheduler = models.SchedulerMinutesLater.objects.create(minutes=5)
+        models.NotificationScheduler.objects.create(
+            notification=self.notification, scheduler=scheduler, order=0)
+
+        models.schedule_notification(pytz.utc, 'a-slug', ['token'])
+        models.schedule_notification(pytz.utc, 'a-slug', ['token1'])
+        # The first one is canceled by the second one, that expires
+        models.schedule_notification(pytz.utc, 'a-slug', ['token2'])
+        models.schedule_notification(pytz.utc, 'a-slug', ['token2']).expire()
+        dispatch.dispatch_due(
+            datetime.datetime.utcnow() + datetime.timedelta(minutes=10))
+
+        self.assertEqual(
+            self.counters(),
+            {'scheduled': 4, 'canceled': 2, 'sent': 1, 'failed': 1})
+        stat = models.NotificationStat.objects.first()
+        self.assertEqual(
+            (stat.category, stat.provider), (self.category, pypn.DUMMY))
+
+    @mock.patch('pypn.Notification.send', side_effect=lambda *args: response())
+    def test_recorder(self, mock_send):
+        instances = [models.NotificationInstance.objects.create(
+            notification=self.notification, tokens='["token"]', data='{}',
+            provider=pypn.DUMMY,
+            scheduled_at=datetime.datetime.utcnow()) for i in range(3)]
+        recorder = dispatch.ResultRecorder(batch_size=10)
+        for instance in instances:
+            instance.send(recorder=recorder)
+        # Already recorded by another worker
+        models.NotificationInstance.objects.filter(pk=instances[0].pk).update(
+            result='other')
+
+        recorder.flush()
+
+        self.assertEqual(self.counters()['sent'], 2)
+
+    @mock.patch('pypn.Notification.send', side_effect=lambda *args: response())
+    def test_rebuild(self, mock_send):
+        models.schedule_notification(pytz.utc, 'a-slug', ['token'])
+        with mock.patch('djpush.executors.SyncExecutor.submit'):
+            models.schedule_notification(pytz.utc, 'a-slug', ['token1'])
+            models.schedule_notification(pytz.utc, 'a-slug', ['token1'])
+        expected = self.counters()
+        models.NotificationStat.objects.update(scheduled=0, sent=10)
+
+        call_command('djpush_rebuild_stats', verbosity=0)
+
+        self.assertEqual(self.counters(), expected)
+        self.assertEqual(
+            models.NotificationStat.objects.get().category, self.category)
+
+    def test_rebuild_since(self):
+        yesterday = self.day - datetime.timedelta(days=1)
+        models.NotificationStat.objects.create(
+            notification=self.notification, provider=pypn.DUMMY,
+            day=yesterday, sent=5)
+
+        self.assertEqual(stats.rebuild_stats(self.day), 0)
+        self.assertEqual(models.NotificationStat.objects.get().sent, 5)
+
+    def test_get_stats(self):
+        other = models.Notification.objects.create(
+            slug='another-slug', enabled=True)
+        yesterday = self.day - datetime.timedelta(days=1)
+        rows = (
+            (self.notification, 'gcm', self.day, 1),
+            (self.notification, 'apns', self.day, 2),
+            (self.notification, 'gcm', yesterday, 4),
+            (other, 'gcm', self.day, 8),
+        )
+        for notification, provider, day, sent in rows:
+            models.NotificationStat.objects.create(
+                notification=notification, category=notification.category,
+                provider=provider, day=day, sent=sent)
+
+        result = stats.get_stats(
+            start=self.day, group_by=('notification__slug', ))
+        by_category = stats.get_stats(
+            group_by=('provider', ), category=self.category)
+
+        self.assertEqual(
+            [(row['notification__slug'], row['sent']) for row in result],
+            [('a-slug', 3), ('another-slug', 8)])
+        self.assertEqual(
+            [(row['provider'], row['sent']) for row in by_category],
+            [('apns', 2), ('gcm', 5)])
+
+
+class ScheduleStatsTestCase(TransactionTestCase):
+    @mock.patch('djpush.models.NotificationInstance.send')
+    def test_counted_after_lock(self, mock_send):
+        notification = models.Notification.objects.create(
+            slug='a-slug', enabled=True)
+        scheduler = models.SchedulerMinutesLater.objects.create(minutes=5)
+        models.NotificationScheduler.objects.create(
+            notification=notification, scheduler=scheduler, order=0)
+        in_atomic_block = []
+        add_stats = models.add_stats
+
+        def check_add_stats(rows):
+            in_atomic_block.append(connection.in_atomic_block)
+            add_stats(rows)
+
+        with mock.patch(
+                'djpush.models.add_stats', side_effect=check_add_stats):
+            models.schedule_notification(pytz.utc, 'a-slug', ['token'])
+            models.schedule_notification(pytz.utc, 'a-slug', ['token'])
+
+        self.assertEqual(in_atomic_block, [False, False])
+        row = stats.get_stats(group_by=('notification', ))[0]
+        self.assertEqual((row['scheduled'], row['canceled']), (2, 1))
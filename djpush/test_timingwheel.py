@@ -0,0 +1,55 @@
+from django.test import SimpleTestCase
+
+from djpush.timingwheel import TimingWheel
+
+
+class TimingWheelTestCase(SimpleTestCase):
+    def test_advance(self):
+        wheel = TimingWheel(now=100, tick=0.01)
+        wheel.add('b', 100.05)
+        wheel.add('a', 100.02)
+        wheel.add('c', 101)
+
+        self.assertEqual(wheel.advance(100.01), [])
+        self.assertEqual(wheel.advance(100.05), ['a', 'b'])
+        self.assertEqual(len(wheel), 1)
+        self.assertEqual(wheel.advance(102), ['c'])
+        self.assertEqual(len(wheel), 0)
+
+    def test_past_due(self):
+        wheel = TimingWheel(now=100, tick=0.01)
+        wheel.add('a', 50)
+
+        self.assertIn('a', wheel)
+        self.assertEqual(wheel.advance(100), ['a'])
+
+    def test_cascade(self):
+        wheel = TimingWheel(now=0, tick=1, wheel_size=4, levels=3)
+        # Level 0 covers 4 ticks, level 1 16 and level 2 64
+        for when in (3, 5, 17, 40, 70, 200):
+            wheel.add(when, when)
+
+        fired = []
+        for now in range(0, 201):
+            for key in wheel.advance(now):
+                fired.append((key, now))
+
+        self.assertEqual(
+            fired, [(3, 3), (5, 5), (17, 17), (40, 40), (70, 70), (200, 200)])
+
+    def test_remove(self):
+        wheel = TimingWheel(now=0, tick=1, wheel_size=4, levels=2)
+        wheel.add('a', 10)
+        wheel.add('b', 10)
+
+        self.assertTrue(wheel.remove('a'))
+        self.assertFalse(wheel.remove('a'))
+        self.assertEqual(wheel.advance(20), ['b'])
+
+    def test_reschedule(self):
+        wheel = TimingWheel(now=0, tick=1)
+        wheel.add('a', 10)
+        wheel.add('a', 5)
+
+        self.assertEqual(wheel.advance(5), ['a'])
+        self.assertEqual(wheel.advance(20), [])
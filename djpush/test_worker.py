@@ -0,0 +1,174 @@
+import datetime
+import threading
+from unittest import mock
+
+from django.test import TestCase
+import pypn
+
+from . import models
+from .test_helpers import response
+from .dispatch import RateLimiter, ResultRecorder
+from .lanes import LaneDispatcher
+from .sharding import Coordinator
+from .worker import Worker, to_timestamp
+
+
+@mock.patch('pypn.Notification.send', side_effect=lambda *args: response())
+class WorkerTestCase(TestCase):
+    def setUp(self):
+        self.notification = models.Notification.objects.create(
+            slug='a-slug', enabled=True)
+        self.start = datetime.datetime(2017, 3, 8, 14, 42)
+        self.now = to_timestamp(self.start)
+
+    def create(self, seconds, **kwargs):
+        return models.NotificationInstance.objects.create(
+            notification=self.notification, tokens='["token"]', data='{}',
+            provider=pypn.DUMMY,
+            scheduled_at=self.start + datetime.timedelta(seconds=seconds),
+            **kwargs)
+
+    def test_fire_on_time(self, mock_send):
+        soon = self.create(1.5)
+        self.create(30)
+        self.create(120)
+        worker = Worker(horizon=60, poll_interval=5, tick=0.01)
+
+        self.assertEqual(worker.run_once(self.now), 0)
+        self.assertEqual(len(worker.wheel), 2)
+        self.assertEqual(worker.run_once(self.now + 1.49), 0)
+        self.assertEqual(worker.run_once(self.now + 1.5), 1)
+
+        soon.refresh_from_db()
+        self.assertIsNone(soon.sent_at)
+        worker.recorder.flush()
+        soon.refresh_from_db()
+        self.assertIsNotNone(soon.sent_at)
+
+    def test_overdue_after_restart(self, mock_send):
+        self.create(-30)
+        self.create(-10, sent_at=self.start)
+        worker = Worker(horizon=60)
+
+        self.assertEqual(worker.run_once(self.now), 1)
+
+    def test_canceled_before_firing(self, mock_send):
+        instance = self.create(1)
+        worker = Worker(horizon=60, poll_interval=5)
+        worker.run_once(self.now)
+
+        models.NotificationInstance.objects.filter(pk=instance.pk).update(
+            canceled=True)
+
+        self.assertEqual(worker.run_once(self.now + 1), 0)
+        self.assertFalse(mock_send.called)
+
+    def test_poll_reconciles(self, mock_send):
+        canceled = self.create(10)
+        worker = Worker(horizon=60, poll_interval=5)
+        worker.run_once(self.now)
+        models.NotificationInstance.objects.filter(pk=canceled.pk).update(
+            canceled=True)
+        new = self.create(8)
+
+        worker.run_once(self.now + 5)
+
+        self.assertEqual(worker.wheel.keys(), [new.pk])
+
+    def test_not_sent_twice(self, mock_send):
+        self.create(1)
+        recorder = ResultRecorder(batch_size=10, flush_interval=60)
+        worker = Worker(horizon=60, poll_interval=5, recorder=recorder)
+
+        self.assertEqual(worker.run_once(self.now + 1), 1)
+        self.assertEqual(worker.run_once(self.now + 6), 0)
+        self.assertEqual(worker.run_once(self.now + 6.01), 0)
+
+        self.assertEqual(mock_send.call_count, 1)
+
+    def test_sharded(self, mock_send):
+        instance = self.create(1)
+        coordinator = Coordinator('worker', partitions=4)
+        worker = Worker(horizon=60, coordinator=coordinator)
+
+        self.assertEqual(worker.run_once(self.now + 1), 1)
+        self.assertEqual(coordinator.owned, set(range(4)))
+        self.assertEqual(
+            models.NotificationInstance.objects.get(pk=instance.pk).claimed_by,
+            'worker')
+
+    def test_sharded_resume(self, mock_send):
+        # Claimed by a worker that died after the first chunk
+        instance = models.NotificationInstance.objects.create(
+            notification=self.notification,
+            tokens='["token0", "token1", "token2"]', data='{}',
+            provider=pypn.DUMMY, scheduled_at=self.start, sent_at=self.start,
+            claimed_by='dead',
+            sent_tokens=2)
+        coordinator = Coordinator('worker', partitions=4)
+        worker = Worker(horizon=60, coordinator=coordinator)
+
+        with mock.patch('djpush.models.DELIVERY_CHUNK_SIZE', 2):
+            self.assertEqual(worker.run_once(self.now), 1)
+
+        self.assertEqual(mock_send.call_count, 1)
+        self.assertEqual(mock_send.call_args[0][0], ['token2'])
+        self.assertEqual(
+            models.NotificationInstance.objects.get(pk=instance.pk).claimed_by,
+            'worker')
+
+    def test_rate_limited(self, mock_send):
+        first = self.create(1)
+        second = self.create(1.5)
+        clock = [0]
+        rate_limiter = RateLimiter(1, clock=lambda: clock[0])
+        worker = Worker(horizon=60, rate_limiter=rate_limiter)
+
+        self.assertEqual(worker.run_once(self.now + 2), 1)
+        self.assertEqual(worker.wheel.keys(), [second.pk])
+        self.assertEqual(worker.run_once(self.now + 2.01), 0)
+        clock[0] = 1
+        self.assertEqual(worker.run_once(self.now + 2.02), 1)
+
+        worker.recorder.flush()
+        instances = models.NotificationInstance.objects
+        self.assertLess(instances.get(pk=first.pk).sent_at,
+                        instances.get(pk=second.pk).sent_at)
+
+    def test_lanes(self, mock_send):
+        self.create(1)
+        lanes = LaneDispatcher(workers=2)
+        worker = Worker(horizon=60, lanes=lanes)
+
+        worker.run_once(self.now + 1)
+        lanes.wait(10)
+
+        self.assertEqual(worker.run_once(self.now + 1.01), 1)
+        lanes.close()
+
+    def test_lanes_not_sent_twice(self, mock_send):
+        self.create(1)
+        delivering = threading.Event()
+        release = threading.Event()
+
+        def slow_send(*args):
+            delivering.set()
+            release.wait(10)
+            return response()
+
+        mock_send.side_effect = slow_send
+        lanes = LaneDispatcher(workers=2)
+        worker = Worker(horizon=60, poll_interval=5, lanes=lanes)
+        self.addCleanup(lanes.close)
+        self.addCleanup(release.set)
+
+        worker.run_once(self.now + 1)
+        delivering.wait(10)
+        # Polls while the instance is in flight
+        worker.run_once(self.now + 6)
+        worker.run_once(self.now + 6.01)
+        release.set()
+        lanes.wait(10)
+
+        self.assertEqual(worker.run_once(self.now + 6.02), 1)
+        self.assertEqual(mock_send.call_count, 1)
@@ -0,0 +1,105 @@
+import math
+
+
+class TimingWheel:
+    """A hierarchical timing wheel. Keys are added with the time(in
+    seconds) they are due and `advance` returns the keys due until the
+    given time. Time is split in ticks of `tick` seconds. The first
+    level has a slot per tick, each slot of the next levels covers a
+    whole turn of the previous level. Keys move to lower levels as
+    time advances, adding and removing keys costs O(1).
+
+    """
+    def __init__(self, now, tick=0.01, wheel_size=256, levels=4):
+        self.tick = tick
+        self.wheel_size = wheel_size
+        self.levels = levels
+        self.current = self._to_tick(now)
+        self._wheels = [[{} for i in range(wheel_size)]
+                        for level in range(levels)]
+        # key -> (due tick, level, slot)
+        self._entries = {}
+        self._ready = {}
+
+    def __len__(self):
+        return len(self._entries) + len(self._ready)
+
+    def __contains__(self, key):
+        return key in self._entries or key in self._ready
+
+    def _to_tick(self, when):
+        return int(math.ceil(when / self.tick))
+
+    def add(self, key, when):
+        """Add `key` due at `when`, replacing it if already added"""
+        self.remove(key)
+        self._add(key, self._to_tick(when))
+
+    def _add(self, key, due):
+        delta = due - self.current
+        if delta <= 0:
+            self._ready[key] = due
+            return
+        level = 0
+        while (level < self.levels - 1 and
+               delta >= self.wheel_size ** (level + 1)):
+            level += 1
+        slot = (due // self.wheel_size ** level) % self.wheel_size
+        self._wheels[level][slot][key] = due
+        self._entries[key] = (due, level, slot)
+
+    def remove(self, key):
+        self._ready.pop(key, None)
+        try:
+            due, level, slot = self._entries.pop(key)
+        except KeyError:
+            return False
+        del self._wheels[level][slot][key]
+        return True
+
+    def keys(self):
+        return list(self._entries) + list(self._ready)
+
+    def advance(self, now):
+        """Move the wheel to `now` and return the due keys ordered by
+        due time
+
+        """
+        target = self._to_tick(now)
+        due = sorted(self._ready.items(), key=lambda item: item[1])
+        self._ready = {}
+        while self.current < target:
+            if not self._entries:
+                # Nothing to cascade or fire, jump
+                self.current = target
+                break
+            self.current += 1
+            self._cascade()
+            # Cascaded keys due now
+            if self._ready:
+                due.extend(sorted(self._ready.items(),
+                                  key=lambda item: item[1]))
+                self._ready = {}
+            slot = self._wheels[0][self.current % self.wheel_size]
+            if slot:
+                for key, key_due in sorted(slot.items(),
+                                           key=lambda item: item[1]):
+                    del self._entries[key]
+                    due.append((key, key_due))
+                slot.clear()
+        return [key for key, key_due in due]
+
+    def _cascade(self):
+        # When a level completes a turn, the current slot of the next
+        # level is moved to lower levels
+        for level in range(1, self.levels):
+            span = self.wheel_size ** level
+            if self.current % span:
+                break
+            slot = self._wheels[level][(self.current // span) %
+                                       self.wheel_size]
+            entries = list(slot.items())
+            slot.clear()
+            for key, due in entries:
+                del self._entries[key]
+                self._add(key, due)
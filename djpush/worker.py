@@ -0,0 +1,151 @@
+import calendar
+import datetime
+import time
+
+from django.conf import settings
+
+from .dispatch import (ResultRecorder, cancel_expired, coalesce,
+                       send_instances)
+from .models import NotificationInstance, chunked, prune_locks
+from .timingwheel import TimingWheel
+
+
+WORKER_HORIZON = getattr(settings, 'DJPUSH_WORKER_HORIZON', 60)
+WORKER_POLL_INTERVAL = getattr(settings, 'DJPUSH_WORKER_POLL_INTERVAL', 5)
+WORKER_TICK = getattr(settings, 'DJPUSH_WORKER_TICK', 0.01)
+
+
+def to_timestamp(value):
+    """`value` is a naive datetime in UTC"""
+    return calendar.timegm(value.utctimetuple()) + value.microsecond / 1e6
+
+
+class Worker:
+    """Long running process sending instances when they are due. Every
+    `poll_interval` seconds instances due in the next `horizon` seconds
+    are loaded in a timing wheel that fires them within a `tick` of
+    `scheduled_at`. Each poll also removes from the wheel instances that
+    were canceled or sent elsewhere, and fired instances are read again
+    before sending. Results are flushed before polling. The wheel is
+    only kept in memory, it's rebuilt from the database when the worker
+    starts.
+
+    With a `sharding.Coordinator` each poll is a heartbeat and only
+    instances of the leased partitions are loaded and claimed,
+    deliveries of dead workers are resumed after the poll. With a
+    `lanes.LaneDispatcher` providers are called by the lanes threads
+    and `run_once` doesn't wait for them, instances pending in the lanes
+    are not loaded again. With a `dispatch.RateLimiter` fired instances
+    over the rate stay in the wheel, before the ones fired later.
+
+    """
+    def __init__(self, horizon=None, poll_interval=None, tick=None,
+                 workers=1, recorder=None, clock=time.time,
+                 coordinator=None, lanes=None, rate_limiter=None):
+        self.horizon = horizon or WORKER_HORIZON
+        self.poll_interval = poll_interval or WORKER_POLL_INTERVAL
+        self.tick = tick or WORKER_TICK
+        self.workers = workers
+        if recorder is None:
+            recorder = ResultRecorder()
+        self.recorder = recorder
+        self.clock = clock
+        self.coordinator = coordinator
+        self.lanes = lanes
+        self.rate_limiter = rate_limiter
+        self.wheel = None
+        self._next_poll = None
+        self._resumed = []
+
+    def rebuild(self, now=None):
+        now = now or self.clock()
+        self.wheel = TimingWheel(now, tick=self.tick)
+        self.poll(now)
+
+    def poll(self, now=None):
+        now = now or self.clock()
+        self._next_poll = now + self.poll_interval
+        # Fired instances not recorded yet would look pending and be
+        # sent again
+        self.recorder.flush()
+        cancel_expired()
+        prune_locks()
+        until = datetime.datetime.utcfromtimestamp(now + self.horizon)
+        pending = NotificationInstance.objects.filter(
+            sent_at__isnull=True,
+            canceled=False,
+            scheduled_at__lte=until,
+        )
+        if self.coordinator is not None:
+            self.coordinator.heartbeat()
+            pending = self.coordinator.filter(pending)
+            self._resumed.extend(self.coordinator.resume())
+        pending = dict(pending.values_list('pk', 'scheduled_at'))
+        # Queued or in flight in the lanes
+        for pk in self.in_lanes():
+            pending.pop(pk, None)
+        for pk in self.wheel.keys():
+            if pk not in pending:
+                self.wheel.remove(pk)
+        for pk, scheduled_at in pending.items():
+            if pk not in self.wheel:
+                self.wheel.add(pk, to_timestamp(scheduled_at))
+
+    def run_once(self, now=None):
+        """Send due instances. Return the number of sent instances"""
+        now = now or self.clock()
+        if self.wheel is None:
+            self.rebuild(now)
+        elif now >= self._next_poll:
+            self.poll(now)
+        due = self.wheel.advance(now)
+        if due and self.rate_limiter is not None:
+            available = self.rate_limiter.available()
+            # Ready on the next advance
+            for pk in due[available:]:
+                self.wheel.add(pk, now)
+            due = due[:available]
+        instances = self.load(due) if due else []
+        if self._resumed:
+            instances, self._resumed = self._resumed + instances, []
+        if instances and self.rate_limiter is not None:
+            self.rate_limiter.consume(len(instances))
+        if self.lanes is not None:
+            if instances:
+                self.lanes.submit(instances)
+            return self.lanes.collect(self.recorder)
+        if not instances:
+            return 0
+        return send_instances(instances, self.workers, self.recorder)
+
+    def in_lanes(self):
+        if self.lanes is None:
+            return set()
+        return self.lanes.pending()
+
+    def load(self, pks):
+        # Could have been canceled since the last poll
+        in_lanes = self.in_lanes()
+        pks = [pk for pk in pks if pk not in in_lanes]
+        instances = []
+        for chunk in chunked(pks, 500):
+            instances.extend(NotificationInstance.objects.filter(
+                pk__in=chunk, sent_at__isnull=True, canceled=False))
+        instances.sort(key=lambda instance: instance.scheduled_at)
+        instances = coalesce(instances)
+        if self.coordinator is not None:
+            instances = self.coordinator.claim(instances)
+        return instances
+
+    def run(self):
+        try:
+            while True:
+                self.run_once()
+                time.sleep(self.tick)
+        finally:
+            if self.lanes is not None:
+                self.lanes.close()
+                self.lanes.collect(self.recorder)
+            self.recorder.flush()
+            if self.coordinator is not None:
+                self.coordinator.unregister()
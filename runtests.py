@@ -1,5 +1,7 @@
 #!/usr/bin/env python
+import os
 import sys
+import tempfile
 
 import django
 from django.conf import settings
@@ -12,7 +14,20 @@ if not settings.configured:
             'default': {
                 'ENGINE': 'django.db.backends.sqlite3',
                 'NAME': ':memory:',
-            }
+                # A file, so the concurrency tests can use it from
+                # several threads. One per run, so parallel runs don't
+                # share it
+                'TEST': {
+                    'NAME': os.path.join(
+                        tempfile.gettempdir(),
+                        'djpush-tests-%d.sqlite3' % os.getpid()),
+                },
+            },
+            # Used by the replica router tests
+            'replica': {
+                'ENGINE': 'django.db.backends.sqlite3',
+                'NAME': ':memory:',
+            },
         },
         INSTALLED_APPS=(
             'djpush',
@@ -39,7 +54,7 @@ def runtests():
         django.setup()
     apps = sys.argv[1:] or ['djpush', ]
     TestRunner = get_runner(settings)
-    test_runner = TestRunner(verbosity=1, interactive=True, failfast=False)
+    test_runner = TestRunner(verbosity=1, interactive=False, failfast=False)
     failures = test_runner.run_tests(apps)
     sys.exit(failures)
 